@@ -0,0 +1,294 @@
+import glob
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, Optional, Set, Tuple
+
+
+DEFAULT_DB_PATH = os.environ.get("ARLES_PRICE_DB", "precios.sqlite3")
+
+
+class PriceStore:
+    """
+    Almacén persistente de precios en SQLite (modo WAL).
+
+    Guarda los cierres de vela por (symbol, quote, minute) y los tipos
+    USD/EUR por día. Los precios se guardan como texto para conservar
+    el Decimal exacto devuelto por la API.
+    """
+
+    def __init__(self, path: str = DEFAULT_DB_PATH, timeout: float = 30.0):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path,
+            timeout=timeout,
+            isolation_level=None,       # transacciones explícitas
+            check_same_thread=False,
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(f"PRAGMA busy_timeout={int(timeout * 1000)}")
+        self._create_schema()
+
+    def _create_schema(self):
+        with self._transaction() as cur:
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS klines (
+                    symbol TEXT NOT NULL,
+                    quote  TEXT NOT NULL,
+                    minute TEXT NOT NULL,      -- 'YYYY-MM-DD HH:MM'
+                    close  TEXT NOT NULL,
+                    PRIMARY KEY (symbol, quote, minute)
+                ) WITHOUT ROWID
+                """
+            )
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS usd_eur (
+                    day  TEXT PRIMARY KEY,     -- 'YYYY-MM-DD'
+                    rate TEXT NOT NULL
+                ) WITHOUT ROWID
+                """
+            )
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS exchange_pairs (
+                    base  TEXT NOT NULL,
+                    quote TEXT NOT NULL,
+                    PRIMARY KEY (base, quote)
+                ) WITHOUT ROWID
+                """
+            )
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS missing_pairs (
+                    base  TEXT NOT NULL,
+                    quote TEXT NOT NULL,
+                    PRIMARY KEY (base, quote)
+                ) WITHOUT ROWID
+                """
+            )
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS gap_fills (
+                    symbol TEXT NOT NULL,
+                    quote  TEXT NOT NULL,
+                    minute TEXT NOT NULL,      -- minuto pedido, sin vela
+                    served TEXT NOT NULL,      -- minuto de la vela servida
+                    PRIMARY KEY (symbol, quote, minute)
+                ) WITHOUT ROWID
+                """
+            )
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Cursor]:
+        """
+        Transacción atómica. BEGIN IMMEDIATE toma el bloqueo de escritura
+        al principio, así varios procesos pueden compartir el fichero sin
+        interbloqueos: el resto espera hasta busy_timeout.
+        """
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                yield cur
+            except BaseException:
+                cur.execute("ROLLBACK")
+                raise
+            else:
+                cur.execute("COMMIT")
+            finally:
+                cur.close()
+
+    # ----------------------------------------------------
+    # Velas
+    # ----------------------------------------------------
+
+    def get_price(self, symbol: str, quote: str, minute: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT close FROM klines WHERE symbol = ? AND quote = ? AND minute = ?",
+                (symbol.upper(), quote.upper(), minute),
+            ).fetchone()
+        return row[0] if row else None
+
+    def put_prices(self, rows: Iterable[Tuple[str, str, str, str]]) -> int:
+        """
+        Inserta (symbol, quote, minute, close) en una única transacción.
+        Devuelve el número de filas escritas.
+        """
+        data = [(s.upper(), q.upper(), m, str(c)) for s, q, m, c in rows]
+        if not data:
+            return 0
+        with self._transaction() as cur:
+            cur.executemany(
+                "INSERT OR REPLACE INTO klines (symbol, quote, minute, close) VALUES (?, ?, ?, ?)",
+                data,
+            )
+        return len(data)
+
+    def put_price(self, symbol: str, quote: str, minute: str, close) -> None:
+        self.put_prices([(symbol, quote, minute, close)])
+
+    def iter_prices(self) -> Iterator[Tuple[str, str, str, str]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT symbol, quote, minute, close FROM klines"
+            ).fetchall()
+        return iter(rows)
+
+    # ----------------------------------------------------
+    # Tipos USD/EUR
+    # ----------------------------------------------------
+
+    def get_rate(self, day: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT rate FROM usd_eur WHERE day = ?", (day,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def put_rates(self, rows: Iterable[Tuple[str, str]]) -> int:
+        data = [(d, str(r)) for d, r in rows]
+        if not data:
+            return 0
+        with self._transaction() as cur:
+            cur.executemany(
+                "INSERT OR REPLACE INTO usd_eur (day, rate) VALUES (?, ?)", data
+            )
+        return len(data)
+
+    def put_rate(self, day: str, rate) -> None:
+        self.put_rates([(day, rate)])
+
+    def iter_rates(self) -> Iterator[Tuple[str, str]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT day, rate FROM usd_eur").fetchall()
+        return iter(rows)
+
+    # ----------------------------------------------------
+    # Pares del exchange
+    # ----------------------------------------------------
+
+    def get_exchange_pairs(self) -> Set[Tuple[str, str]]:
+        with self._lock:
+            return set(self._conn.execute("SELECT base, quote FROM exchange_pairs").fetchall())
+
+    def replace_exchange_pairs(self, pairs: Iterable[Tuple[str, str]]) -> int:
+        data = sorted(set(pairs))
+        with self._transaction() as cur:
+            cur.execute("DELETE FROM exchange_pairs")
+            cur.executemany("INSERT INTO exchange_pairs (base, quote) VALUES (?, ?)", data)
+        return len(data)
+
+    def get_missing_pairs(self) -> Set[Tuple[str, str]]:
+        with self._lock:
+            return set(self._conn.execute("SELECT base, quote FROM missing_pairs").fetchall())
+
+    def put_missing_pair(self, base: str, quote: str) -> None:
+        with self._transaction() as cur:
+            cur.execute(
+                "INSERT OR IGNORE INTO missing_pairs (base, quote) VALUES (?, ?)",
+                (base.upper(), quote.upper()),
+            )
+
+    # ----------------------------------------------------
+    # Huecos rellenados
+    # ----------------------------------------------------
+
+    def get_gap_fills(self) -> Dict[Tuple[str, str, str], str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT symbol, quote, minute, served FROM gap_fills").fetchall()
+        return {(s, q, m): served for s, q, m, served in rows}
+
+    def put_gap_fill(self, symbol: str, quote: str, minute: str, served: str) -> None:
+        with self._transaction() as cur:
+            cur.execute(
+                "INSERT OR REPLACE INTO gap_fills (symbol, quote, minute, served) VALUES (?, ?, ?, ?)",
+                (symbol.upper(), quote.upper(), minute, served),
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# ----------------------------------------------------
+# Instancia única por proceso
+# ----------------------------------------------------
+
+_store: Optional[PriceStore] = None
+_store_pid: Optional[int] = None
+
+
+def get_store(path: Optional[str] = None) -> PriceStore:
+    """
+    Devuelve el almacén de la ejecución, abriéndolo la primera vez.
+    Una conexión SQLite no debe cruzar un fork, así que cada proceso
+    hijo abre la suya propia.
+    Si el fichero aún no existe se crea y se importan los JSON antiguos
+    del directorio actual (migración única).
+    """
+    global _store, _store_pid
+    if _store is None or _store_pid != os.getpid():
+        path = path or DEFAULT_DB_PATH
+        is_new = not os.path.exists(path)
+        _store = PriceStore(path)
+        _store_pid = os.getpid()
+        if is_new:
+            import_json_snapshots(_store, os.path.dirname(os.path.abspath(path)))
+    return _store
+
+
+# ----------------------------------------------------
+# Importación de los antiguos ficheros JSON
+# ----------------------------------------------------
+
+def split_price_key(key: str) -> Tuple[str, str, str]:
+    """
+    'BTC_EUR_2025-01-03 11:38' -> ('BTC', 'EUR', '2025-01-03 11:38')
+    """
+    symbol, quote, minute = key.split("_", 2)
+    return symbol, quote, minute
+
+
+def import_json_snapshots(store: PriceStore, directory: str = ".") -> Tuple[int, int]:
+    """
+    Vuelca en el almacén todos los binance_prices_*.json y usd_eur_rates_*.json
+    de un directorio. Se procesan de más antiguo a más reciente, de modo que
+    ante claves repetidas gana el snapshot más nuevo.
+    Devuelve (precios importados, tipos importados).
+    """
+    n_prices = 0
+    for path in sorted(glob.glob(os.path.join(directory, "binance_prices_*.json"))):
+        with open(path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+        n_prices += store.put_prices(
+            (*split_price_key(key), value) for key, value in cache.items()
+        )
+        print(f"Importado {path}: {len(cache)} precios")
+
+    n_rates = 0
+    for path in sorted(glob.glob(os.path.join(directory, "usd_eur_rates_*.json"))):
+        with open(path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+        n_rates += store.put_rates(cache.items())
+        print(f"Importado {path}: {len(cache)} tipos USD/EUR")
+
+    return n_prices, n_rates
+
+
+if __name__ == "__main__":
+    import sys
+
+    directory = sys.argv[1] if len(sys.argv) > 1 else "."
+    db_path = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_DB_PATH
+
+    store = PriceStore(db_path)
+    n_prices, n_rates = import_json_snapshots(store, directory)
+    print(f"Almacén {db_path}: {n_prices} precios y {n_rates} tipos importados")
+    store.close()
@@ -0,0 +1,173 @@
+import csv
+import glob
+import io
+import os
+import re
+import threading
+import zipfile
+from decimal import Decimal
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+
+DEFAULT_ARCHIVE_DIR = os.environ.get("ARLES_KLINE_ARCHIVE", "klines_archive")
+
+PRICE_SCALE = 8                  # cierre en punto fijo: 1e-8
+_DUMP_NAME = re.compile(r"^(?P<pair>[A-Z0-9]+)-1m-\d{4}-\d{2}(-\d{2})?\.zip$")
+
+
+def _to_ms(open_time: int) -> int:
+    """
+    Los volcados de Binance usan milisegundos hasta 2024 y microsegundos
+    desde enero de 2025.
+    """
+    return open_time // 1000 if open_time > 10**14 else open_time
+
+
+def _to_fixed(close: str) -> int:
+    return int(Decimal(close).scaleb(PRICE_SCALE))
+
+
+def read_dump(path: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Lee un zip mensual (o diario) de data.binance.vision con velas de
+    1 minuto. Devuelve (open_time en ms, cierre en punto fijo) como int64.
+    """
+    times, closes = [], []
+    with zipfile.ZipFile(path) as zf:
+        for name in zf.namelist():
+            if not name.endswith(".csv"):
+                continue
+            with zf.open(name) as raw:
+                for row in csv.reader(io.TextIOWrapper(raw, encoding="utf-8")):
+                    # Algunos volcados traen cabecera (open_time,open,...)
+                    if not row or not row[0].isdigit():
+                        continue
+                    times.append(_to_ms(int(row[0])))
+                    closes.append(_to_fixed(row[4]))
+    return np.array(times, dtype=np.int64), np.array(closes, dtype=np.int64)
+
+
+class KlineArchive:
+    """
+    Archivo local de velas de 1 minuto por par, en columnas:
+
+        <dir>/<PAIR>.time.i8   open_time en ms, int64 ordenado
+        <dir>/<PAIR>.close.i8  cierre * 1e8, int64
+
+    Los ficheros se abren con memmap bajo demanda y cada consulta es una
+    búsqueda binaria sobre open_time.
+    """
+
+    def __init__(self, directory: str = DEFAULT_ARCHIVE_DIR):
+        self.directory = directory
+        self._pairs: Dict[str, Optional[Tuple[np.ndarray, np.ndarray]]] = {}
+        self._lock = threading.Lock()
+
+    def _paths(self, pair: str) -> Tuple[str, str]:
+        base = os.path.join(self.directory, pair.upper())
+        return f"{base}.time.i8", f"{base}.close.i8"
+
+    def _columns(self, pair: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        pair = pair.upper()
+        with self._lock:
+            if pair not in self._pairs:
+                time_path, close_path = self._paths(pair)
+                if os.path.exists(time_path) and os.path.getsize(time_path) > 0:
+                    self._pairs[pair] = (
+                        np.memmap(time_path, dtype=np.int64, mode="r"),
+                        np.memmap(close_path, dtype=np.int64, mode="r"),
+                    )
+                else:
+                    self._pairs[pair] = None
+            return self._pairs[pair]
+
+    def has_pair(self, pair: str) -> bool:
+        return self._columns(pair) is not None
+
+    def close_at(self, pair: str, open_time_ms: int) -> Optional[Decimal]:
+        """
+        Cierre de la vela que abre exactamente en open_time_ms, o None.
+        """
+        columns = self._columns(pair)
+        if columns is None:
+            return None
+        times, closes = columns
+        i = int(np.searchsorted(times, open_time_ms))
+        if i < len(times) and times[i] == open_time_ms:
+            return Decimal(int(closes[i])).scaleb(-PRICE_SCALE)
+        return None
+
+    def write_pair(self, pair: str, times: np.ndarray, closes: np.ndarray):
+        """
+        Fusiona velas nuevas con las ya archivadas del par y reescribe sus
+        columnas ordenadas y sin duplicados (gana la vela nueva).
+        """
+        pair = pair.upper()
+        os.makedirs(self.directory, exist_ok=True)
+        time_path, close_path = self._paths(pair)
+
+        with self._lock:
+            old = self._pairs.pop(pair, None)
+            if old is None and os.path.exists(time_path):
+                old = (np.fromfile(time_path, dtype=np.int64), np.fromfile(close_path, dtype=np.int64))
+            if old is not None:
+                times = np.concatenate([times, np.asarray(old[0])])
+                closes = np.concatenate([closes, np.asarray(old[1])])
+                del old
+
+            # np.unique se queda con la primera aparición: las velas nuevas
+            times, first = np.unique(times, return_index=True)
+            closes = closes[first]
+
+            for path, column in ((time_path, times), (close_path, closes)):
+                tmp = f"{path}.tmp"
+                column.astype(np.int64).tofile(tmp)
+                os.replace(tmp, path)
+
+
+def import_kline_dumps(source_dir: str, archive: Optional["KlineArchive"] = None) -> Dict[str, int]:
+    """
+    Importa todos los <PAIR>-1m-YYYY-MM.zip de source_dir al archivo.
+    Devuelve {par: velas importadas}.
+    """
+    archive = archive or get_kline_archive()
+    by_pair: Dict[str, list] = {}
+    for path in sorted(glob.glob(os.path.join(source_dir, "*.zip"))):
+        match = _DUMP_NAME.match(os.path.basename(path))
+        if match:
+            by_pair.setdefault(match.group("pair"), []).append(path)
+
+    imported = {}
+    for pair, paths in sorted(by_pair.items()):
+        parts = [read_dump(p) for p in paths]
+        times = np.concatenate([t for t, _ in parts])
+        closes = np.concatenate([c for _, c in parts])
+        archive.write_pair(pair, times, closes)
+        imported[pair] = len(times)
+        print(f"Archivadas {len(times)} velas de {pair} ({len(paths)} ficheros)")
+    return imported
+
+
+_archive: Optional[KlineArchive] = None
+
+
+def get_kline_archive() -> KlineArchive:
+    """Archivo único del proceso (ARLES_KLINE_ARCHIVE o ./klines_archive)."""
+    global _archive
+    if _archive is None:
+        _archive = KlineArchive(DEFAULT_ARCHIVE_DIR)
+    return _archive
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 2:
+        print("Uso: python archivo_klines.py carpeta_zips [carpeta_archivo]")
+        sys.exit(1)
+
+    target = KlineArchive(sys.argv[2]) if len(sys.argv) > 2 else get_kline_archive()
+    totals = import_kline_dumps(sys.argv[1], target)
+    print(f"Archivo {target.directory}: {sum(totals.values())} velas en {len(totals)} pares")
@@ -1,146 +1,463 @@
 from decimal import Decimal
-import urllib.request, json
+import atexit
+import csv
 import os
-import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, timedelta, datetime
+from typing import Optional, Sequence
+import numpy as np
 import pandas as pd
 
 import requests
 
+from almacen_precios import get_store
+from archivo_klines import get_kline_archive
+from cache_compacta import CompactPriceCache, epoch_minute, minute_epoch
+from grafo_precios import PairNotFound, PriceGraph
+from punto_fijo import amount_as_eur, amount_decimal, eur_value
+from resolucion_precios import INTERVAL_MS, ResolutionPolicy
+from proveedores_precios import (
+    ArchiveProvider, BinanceProvider, CoinGeckoProvider, GapFillProvider, GapFills,
+    KnownGapProvider, MemoryProvider, PriceProvider, ProviderChain, StoreProvider,
+)
+from limitador_peticiones import get_governor
 
-def get_usd_to_eur_rate(query_date: str) -> Decimal:
+
+# ============================
+#   CACHÉ DE PROCESO
+# ============================
+
+class PriceCache:
     """
-    Consulta el tipo de cambio USD/EUR del BCE para una fecha dada (YYYY-MM-DD)
-    usando la Frankfurter API (datos oficiales del BCE).
+    Memoria de precios del proceso sobre el almacén persistente.
+
+    Carga el almacén completo la primera vez y sirve los aciertos desde
+    memoria; las velas viven en una CompactPriceCache. Los precios nuevos
+    quedan como entradas sucias y se vuelcan por lotes: al llegar a
+    flush_batch entradas, cuando han pasado flush_interval segundos desde
+    el último volcado y al salir.
     """
 
-    today_str = date.today().isoformat()
-    cache_file = f"usd_eur_rates_{today_str}.json"
+    def __init__(self, store, flush_interval: float = 30.0, flush_batch: int = 500):
+        self.store = store
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+
+        self.prices = CompactPriceCache()
+        self.rates = {}             # 'YYYY-MM-DD' -> Decimal
+        self._dirty_prices = {}
+        self._dirty_rates = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+
+        self._loaded = False
+        self._last_flush = time.monotonic()
+        self._lock = threading.RLock()
+
+    def _load(self):
+        if self._loaded:
+            return
+        self.prices.load(
+            (symbol, quote, minute_epoch(minute), Decimal(close))
+            for symbol, quote, minute, close in self.store.iter_prices()
+        )
+        for day, rate in self.store.iter_rates():
+            self.rates[day] = Decimal(rate)
+        self._loaded = True
+
+    def _count(self, value: Optional[Decimal]) -> Optional[Decimal]:
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def get_price(self, symbol: str, quote: str, minute: str) -> Optional[Decimal]:
+        with self._lock:
+            self._load()
+            return self._count(self.prices.exact(symbol.upper(), quote.upper(), minute_epoch(minute)))
+
+    def put_price(self, symbol: str, quote: str, minute: str, close: Decimal, persist: bool = True):
+        """
+        persist=False solo memoriza (p. ej. precios que ya viven en el
+        archivo offline y no hace falta duplicar en el almacén).
+        """
+        key = (symbol.upper(), quote.upper(), minute)
+        with self._lock:
+            self._load()
+            self.prices.put(key[0], key[1], minute_epoch(minute), close)
+            if persist:
+                self._dirty_prices[key] = close
+                self._maybe_flush()
+
+    def nearest_price(self, symbol: str, quote: str, minute: str, max_distance: int) -> Optional[tuple]:
+        """(minuto, cierre) de la vela en memoria más cercana anterior o igual a minute."""
+        with self._lock:
+            self._load()
+            found = self.prices.nearest(
+                symbol.upper(), quote.upper(), minute_epoch(minute), max_distance, before_only=True
+            )
+        return None if found is None else (epoch_minute(found[0]), found[1])
+
+    def get_rate(self, day: str) -> Optional[Decimal]:
+        with self._lock:
+            self._load()
+            return self._count(self.rates.get(day))
+
+    def put_rate(self, day: str, rate: Decimal):
+        with self._lock:
+            self._load()
+            self.rates[day] = rate
+            self._dirty_rates[day] = rate
+            self._maybe_flush()
+
+    def _maybe_flush(self):
+        pending = len(self._dirty_prices) + len(self._dirty_rates)
+        elapsed = time.monotonic() - self._last_flush
+        if pending >= self.flush_batch or (pending and elapsed >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """
+        Escribe las entradas sucias en el almacén en una transacción por tabla.
+        """
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if not self._dirty_prices and not self._dirty_rates:
+                return
+            if self._dirty_prices:
+                self.store.put_prices(
+                    (s, q, m, c) for (s, q, m), c in self._dirty_prices.items()
+                )
+                self._dirty_prices.clear()
+            if self._dirty_rates:
+                self.store.put_rates(self._dirty_rates.items())
+                self._dirty_rates.clear()
+            self.flushes += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "flushes": self.flushes,
+                "pending": len(self._dirty_prices) + len(self._dirty_rates),
+                "prices": len(self.prices),
+                "prices_bytes": self.prices.nbytes(),
+                "rates": len(self.rates),
+            }
+
+
+_cache: Optional[PriceCache] = None
+_cache_pid: Optional[int] = None
+_cache_config = {"flush_interval": 30.0, "flush_batch": 500}
+
+
+def configure_price_cache(flush_interval: Optional[float] = None, flush_batch: Optional[int] = None):
+    """
+    Ajusta la política de volcado de la caché (también la ya abierta).
+    """
+    if flush_interval is not None:
+        _cache_config["flush_interval"] = flush_interval
+    if flush_batch is not None:
+        _cache_config["flush_batch"] = flush_batch
+    if _cache is not None:
+        _cache.flush_interval = _cache_config["flush_interval"]
+        _cache.flush_batch = _cache_config["flush_batch"]
 
-    if not os.path.exists(cache_file):
-        # Buscar ficheros anteriores
-        backups = [f for f in os.listdir(".") if f.startswith("usd_eur_rates_") and f.endswith(".json")]
-        if backups:
-            # Ordenar por fecha descendente
-            backups.sort(reverse=True)
-            last_backup = backups[0]
-            shutil.copy(last_backup, cache_file)
-            print(f"Copiado {last_backup} como base para {cache_file}")
 
-    # Cargar caché actual (si existe)
-    if os.path.exists(cache_file):
-        with open(cache_file, "r", encoding="utf-8") as f:
-            cache = json.load(f)
-    else:
-        cache = {}
+def get_price_cache() -> PriceCache:
+    """
+    Caché única por proceso. Se vuelca automáticamente al salir.
+    """
+    global _cache, _cache_pid
+    if _cache is None or _cache_pid != os.getpid():
+        _cache = PriceCache(get_store(), **_cache_config)
+        _cache_pid = os.getpid()
+        atexit.register(_cache.flush)
+    return _cache
 
-    # Si ya está en caché, devolverlo
-    if query_date in cache:
-        return Decimal(str(cache[query_date]))
-    
-    # Consultar API
 
-    url = f"https://api.frankfurter.app/{query_date}?from=USD&to=EUR"
-    with urllib.request.urlopen(url) as response:
-        data = json.loads(response.read().decode())
+FRANKFURTER_URL = os.environ.get("ARLES_FRANKFURTER_URL", "https://api.frankfurter.app")
+
+
+def fetch_usd_eur_rate(query_date: str) -> Decimal:
+    """
+    Descarga de la Frankfurter API el tipo USD/EUR de una fecha (sin caché).
+    """
+    url = f"{FRANKFURTER_URL}/{query_date}?from=USD&to=EUR"
+    data = get_governor().get(url).json()
 
     # La API devuelve algo como:
     # {"amount":1.0,"base":"USD","date":"2022-12-23","rates":{"EUR":0.943}}
     if "rates" in data and "EUR" in data["rates"]:
-        rate = Decimal(str(data["rates"]["EUR"]))
-        print("Cambio: " + str(rate))
+        return Decimal(str(data["rates"]["EUR"]))
+    raise ValueError(f"No se encontró tipo USD/EUR para {query_date}")
 
-        cache[query_date] = str(rate)
-        with open(cache_file, "w", encoding="utf-8") as f:
-            json.dump(cache, f, indent=2, sort_keys=True)
-        return rate
+
+# ============================
+#   HISTÓRICO USD/EUR
+# ============================
+
+class UsdEurHistory:
+    """
+    Serie diaria densa de tipos USD/EUR indexada por fecha.
+
+    Los días sin publicación (fines de semana, festivos TARGET) toman el
+    último tipo publicado, igual que responde Frankfurter para esas fechas.
+    Las fechas anteriores a la primera publicación no tienen tipo; la serie
+    llega hasta la última publicación o hasta end si se pide más.
+    """
+
+    def __init__(self, points: dict, end: Optional[date] = None):
+        self.points = dict(points)              # date -> Decimal publicados
+        self.start = min(self.points)
+        self.end = max([*self.points, *([end] if end else [])])
+        self.rates = []
+        last = None
+        for i in range((self.end - self.start).days + 1):
+            last = self.points.get(self.start + timedelta(days=i), last)
+            self.rates.append(last)
+
+    def rate(self, query_date: str) -> Optional[Decimal]:
+        i = (date.fromisoformat(query_date) - self.start).days
+        if 0 <= i < len(self.rates):
+            return self.rates[i]
+        return None
+
+    def covers(self, query_date: str) -> bool:
+        return self.rate(query_date) is not None
+
+
+_usd_eur_history: Optional[UsdEurHistory] = None
+
+USD_EUR_LOOKBACK_DAYS = 7   # cubre fines de semana y festivos TARGET seguidos
+
+
+def fetch_usd_eur_range(start: str, end: str) -> dict:
+    """
+    Serie temporal de Frankfurter en una sola llamada:
+    {"rates": {"2024-01-02": {"EUR": 0.91}, ...}} -> {date: Decimal}
+    """
+    url = f"{FRANKFURTER_URL}/{start}..{end}?from=USD&to=EUR"
+    data = get_governor().get(url).json()
+    return {
+        date.fromisoformat(day): Decimal(str(values["EUR"]))
+        for day, values in data.get("rates", {}).items()
+        if "EUR" in values
+    }
+
+
+def read_ecb_history_csv(path: str) -> dict:
+    """
+    Lee eurofxref-hist.csv del BCE (Date,USD,JPY,... con 1 EUR = x USD)
+    y devuelve {date: tipo USD->EUR}, redondeado a 5 decimales.
+    """
+    points = {}
+    with open(path, newline="", encoding="utf-8") as f:
+        for r in csv.DictReader(f):
+            usd = (r.get("USD") or "").strip()
+            if not usd or usd == "N/A":
+                continue
+            rate = (Decimal(1) / Decimal(usd)).quantize(Decimal("0.00001"))
+            points[date.fromisoformat(r["Date"].strip())] = rate
+    return points
+
+
+def load_usd_eur_history(start: Optional[str] = None, end: Optional[str] = None, csv_path: Optional[str] = None) -> UsdEurHistory:
+    """
+    Carga de una vez el histórico USD/EUR, desde el CSV del BCE o desde
+    Frankfurter para [start, end], y lo fusiona con el ya cargado.
+    Después get_usd_to_eur_rate responde en O(1) sin red.
+    """
+    global _usd_eur_history
+    until = None
+    if csv_path:
+        points = read_ecb_history_csv(csv_path)
     else:
-        raise ValueError(f"No se encontró tipo USD/EUR para {query_date}")
+        points = fetch_usd_eur_range(start, end)
+        until = min(date.fromisoformat(end), date.today())
+    if not points:
+        raise ValueError(f"No se encontraron tipos USD/EUR entre {start} y {end}")
 
+    if _usd_eur_history is not None:
+        points = {**_usd_eur_history.points, **points}
+        until = max(until or _usd_eur_history.end, _usd_eur_history.end)
+    _usd_eur_history = UsdEurHistory(points, until)
+    print(f"Histórico USD/EUR: {_usd_eur_history.start} .. {_usd_eur_history.end} ({len(points)} publicaciones)")
+    return _usd_eur_history
 
-def convert_stables_in_df(df):
+
+def get_local_usd_to_eur_rate(query_date: str) -> Optional[Decimal]:
     """
-    Recorre el DataFrame y convierte USDC/USDT a EUR en las columnas
-    Emitido_Valor_EUR, Recibido_Valor_EUR y Comision_Valor_EUR.
+    Tipo USD/EUR sin red: caché del proceso o histórico cargado en bloque.
     """
-    for idx, row in df.iterrows():
-        # Fecha en formato YYYY-MM-DD
-        date_str = str(row["UTC_Time"])[:10]
-        rate = get_usd_to_eur_rate(date_str)
+    cached = get_price_cache().get_rate(query_date)
+    if cached is not None:
+        return cached
+    if _usd_eur_history is not None:
+        return _usd_eur_history.rate(query_date)
+    return None
 
-        # Emitido
-        if row["Emitido_Moneda"] in ("USDC", "USDT"):
-            df.at[idx, "Emitido_Valor_EUR"] = Decimal(str(row["Emitido_Cantidad"])) * rate
 
-        # Recibido
-        if row["Recibido_Moneda"] in ("USDC", "USDT"):
-            df.at[idx, "Recibido_Valor_EUR"] = Decimal(str(row["Recibido_Cantidad"])) * rate
+def get_usd_to_eur_rate(query_date: str) -> Decimal:
+    """
+    Consulta el tipo de cambio USD/EUR del BCE para una fecha dada (YYYY-MM-DD)
+    usando la Frankfurter API (datos oficiales del BCE).
+    """
 
-        # Comisión
-        if row["Comision_Moneda"] in ("USDC", "USDT"):
-            df.at[idx, "Comision_Valor_EUR"] = Decimal(str(row["Comision_Cantidad"])) * rate
+    cache = get_price_cache()
 
-    return df
+    # Si ya está en caché o en el histórico, devolverlo
+    local = get_local_usd_to_eur_rate(query_date)
+    if local is not None:
+        return local
 
-def translate_eur_values(df):
+    if _chain_config["offline"]:
+        raise ValueError(f"Tipo USD/EUR de {query_date} no disponible sin red")
+    
+    # Consultar API
+    rate = fetch_usd_eur_rate(query_date)
+    print("Cambio: " + str(rate))
+
+    cache.put_rate(query_date, rate)
+    return rate
+
+
+LEGS = ("Emitido", "Recibido", "Comision")
+
+
+def _assign_values(df, mask, column: str, values):
     """
-    Recorre el DataFrame y, si la moneda es EUR, copia la cantidad
-    directamente a la columna *_Valor_EUR correspondiente.
+    df.loc[mask, column] = values sin que pandas convierta los Decimal:
+    la columna pasa a object solo si se escribe algo, como hacía df.at.
+    Los valores van en punto fijo (unidades de 1e-10 EUR, ver punto_fijo).
     """
-    for idx, row in df.iterrows():
-        # Emitido
-        if row["Emitido_Moneda"] == "EUR":
-            df.at[idx, "Emitido_Valor_EUR"] = Decimal(str(row["Emitido_Cantidad"]))
+    if not mask.any():
+        return
+    if df[column].dtype != object:
+        df[column] = df[column].astype(object)
+    df.loc[mask, column] = values
 
-        # Recibido
-        if row["Recibido_Moneda"] == "EUR":
-            df.at[idx, "Recibido_Valor_EUR"] = Decimal(str(row["Recibido_Cantidad"]))
 
-        # Comisión
-        if row["Comision_Moneda"] == "EUR":
-            df.at[idx, "Comision_Valor_EUR"] = Decimal(str(row["Comision_Cantidad"]))
+def _stable_masks(df) -> tuple:
+    """({pata: máscara de filas con USDC/USDT en esa pata}, máscara de cualquiera)."""
+    masks = {leg: df[f"{leg}_Moneda"].isin(("USDC", "USDT")) for leg in LEGS}
+    return masks, masks["Emitido"] | masks["Recibido"] | masks["Comision"]
+
+
+def convert_stables_in_df(df):
+    """
+    Convierte USDC/USDT a EUR en las columnas Emitido_Valor_EUR,
+    Recibido_Valor_EUR y Comision_Valor_EUR, por columnas: una máscara por
+    pata y un solo tipo USD/EUR por fecha, solo de las fechas con estables.
+    """
+    masks, any_stable = _stable_masks(df)
+    if not any_stable.any():
+        return df
+
+    # Fecha en formato YYYY-MM-DD
+    days = df["UTC_Time"].astype(str).str[:10]
+    rates = {day: get_usd_to_eur_rate(day) for day in sorted(days[any_stable].unique())}
+
+    for leg, mask in masks.items():
+        values = [
+            eur_value(rates[day], int(amount))
+            for amount, day in zip(df.loc[mask, f"{leg}_Cantidad"], days[mask])
+        ]
+        _assign_values(df, mask, f"{leg}_Valor_EUR", values)
+
+    return df
+
+def translate_eur_values(df):
+    """
+    Si la moneda de una pata es EUR, copia la cantidad directamente a la
+    columna *_Valor_EUR correspondiente (por columnas, una máscara por pata).
+    """
+    for leg in LEGS:
+        mask = df[f"{leg}_Moneda"] == "EUR"
+        _assign_values(df, mask, f"{leg}_Valor_EUR", [amount_as_eur(v) for v in df.loc[mask, f"{leg}_Cantidad"]])
 
-        # Recibido no EUR pero Emitido si, coversión con valor en euros tomado
-        if row["Recibido_Moneda"] != "EUR" and row["Emitido_Moneda"] == "EUR":
-            df.at[idx, "Recibido_Valor_EUR"] = Decimal(str(row["Emitido_Cantidad"]))
+    # Recibido no EUR pero Emitido si, coversión con valor en euros tomado
+    mask = (df["Recibido_Moneda"] != "EUR") & (df["Emitido_Moneda"] == "EUR")
+    _assign_values(df, mask, "Recibido_Valor_EUR", [amount_as_eur(v) for v in df.loc[mask, "Emitido_Cantidad"]])
 
     return df
 
 
 def convert_no_stables_in_df(df):
     """
-    Recorre el DataFrame y convierte no estables ni fiat a EUR en las columnas
-    Emitido_Valor_EUR, Recibido_Valor_EUR y Comision_Valor_EUR.
-    """
-    for idx, row in df.iterrows():
-        # Fecha en formato YYYY-MM-DD
-        date_str = pd.to_datetime(row["UTC_Time"], errors="coerce").strftime("%Y-%m-%d %H:%M")
-            
-        # Emitido
-        if row["Emitido_Moneda"] and row["Emitido_Moneda"] and row["Emitido_Moneda"] not in ("EUR", "USD"):            
-            if row["Emitido_Cantidad"] is not None and (pd.isna(row["Emitido_Valor_EUR"]) or row["Emitido_Valor_EUR"] == ""):
-                if row["Recibido_Moneda"] and row["Recibido_Moneda"] and row["Recibido_Moneda"] not in ("EUR", "USD"): 
-                    price = get_price_binance(row["Emitido_Moneda"],date_str)                                
-                    df.at[idx, "Emitido_Valor_EUR"] = price * Decimal(str(row["Emitido_Cantidad"]))
-                else:
-                    print (f"VALOR DIRECTO --->  {str(idx)}")
-                    price =  Decimal(str(row["Recibido_Valor_EUR"]))
-                    df.at[idx, "Emitido_Valor_EUR"] = price   
-
-        # Recibido
-        if row["Recibido_Moneda"] and row["Recibido_Moneda"] and row["Recibido_Moneda"] not in ("EUR", "USD"):           
-            if row["Recibido_Cantidad"] is not None and (pd.isna(row["Recibido_Valor_EUR"]) or row["Recibido_Valor_EUR"] == ""):
-                price = get_price_binance(row["Recibido_Moneda"],date_str)
-                df.at[idx, "Recibido_Valor_EUR"] = price * Decimal(str(row["Recibido_Cantidad"]))
-
-        # Comisión
-        if row["Comision_Moneda"] and row["Comision_Moneda"] and row["Comision_Moneda"] not in ("EUR", "USD"):            
-            if row["Comision_Cantidad"] is not None and (pd.isna(row["Comision_Valor_EUR"]) or row["Comision_Valor_EUR"] == ""):
-                price = get_price_binance(row["Comision_Moneda"],date_str)
-                df.at[idx, "Comision_Valor_EUR"] = price * Decimal(str(row["Comision_Cantidad"]))
+    Convierte no estables ni fiat a EUR en las columnas Emitido_Valor_EUR,
+    Recibido_Valor_EUR y Comision_Valor_EUR:
+
+        1. price_legs: una fila por pata a valorar, con su minuto
+        2. resolución y minuto clave de cada pata
+        3. cada (moneda, minuto) distinto se valora una sola vez
+        4. los precios vuelven a las patas con un merge y se escriben por columnas
+
+    Emitido toma el valor de Recibido cuando Recibido es EUR/USD.
+    La resolución de vela usada en cada pata (ver configure_resolution)
+    queda anotada en Resolucion_Precio, p. ej. "Recibido=1m Comision=1d".
+    Con el relleno de huecos activo, las patas valoradas con una vela
+    anterior a la pedida se marcan en Hueco_Precio.
+    """
+    if "Resolucion_Precio" not in df.columns:
+        df["Resolucion_Precio"] = ""
+    gap_fill = bool(_chain_config["gap_fill"])
+    if gap_fill and "Hueco_Precio" not in df.columns:
+        df["Hueco_Precio"] = ""
+
+    legs, direct = price_legs(df, with_direct=True)
+
+    # Emitido sin precio de mercado: valor directo de Recibido
+    for pos in np.flatnonzero(direct):
+        print (f"VALOR DIRECTO --->  {str(df.index[pos])}")
+    _assign_values(df, direct, "Emitido_Valor_EUR", list(df.loc[direct, "Recibido_Valor_EUR"]))
+
+    if legs.empty:
+        return df
+
+    legs["interval"] = leg_intervals(legs)
+    buckets = {key: bucket_minute(*key) for key in set(zip(legs["minute"], legs["interval"]))}
+    legs["key_minute"] = [buckets[key] for key in zip(legs["minute"], legs["interval"])]
+
+    prices = legs[["coin", "key_minute"]].drop_duplicates().reset_index(drop=True)
+    prices["price"] = [get_price_binance(coin, minute) for coin, minute in zip(prices["coin"], prices["key_minute"])]
+    if gap_fill:
+        prices["gaps"] = [gap_fills_for(coin, minute) for coin, minute in zip(prices["coin"], prices["key_minute"])]
+    legs = legs.merge(prices, on=["coin", "key_minute"], how="left", sort=False)
+    legs["value"] = [eur_value(price, int(amount)) for price, amount in zip(legs["price"], legs["amount"])]
+
+    for leg in LEGS:
+        part = legs[legs["leg"] == leg]
+        mask = np.zeros(len(df), dtype=bool)
+        mask[part["pos"].to_numpy()] = True
+        _assign_values(df, mask, f"{leg}_Valor_EUR", list(part["value"]))
+
+    # Anotaciones por fila, patas en orden Emitido, Recibido, Comision
+    legs = legs.sort_values("pos", kind="stable")
+    resolutions, gaps = {}, {}
+    for pos, leg, interval in zip(legs["pos"], legs["leg"], legs["interval"]):
+        resolutions.setdefault(pos, []).append(f"{leg}={interval}")
+    if gap_fill:
+        for pos, leg, notes in zip(legs["pos"], legs["leg"], legs["gaps"]):
+            if notes:
+                gaps.setdefault(pos, []).extend(f"{leg} {g}" for g in notes)
+    for column, notes, sep in (("Resolucion_Precio", resolutions, " "), ("Hueco_Precio", gaps, "; ")):
+        mask = np.zeros(len(df), dtype=bool)
+        mask[sorted(notes)] = True
+        _assign_values(df, mask, column, [sep.join(notes[pos]) for pos in sorted(notes)])
 
     return df    
 
+
+COINGECKO_API_URL = os.environ.get("ARLES_COINGECKO_URL", "https://api.coingecko.com/api/v3")
+
+
 def get_price_coingecko(asset_id: str, date_str: str, vs_currency: str = "usd") -> Decimal:
     """
     Obtiene el precio histórico de un cripto en CoinGecko.
@@ -149,9 +466,9 @@ def get_price_coingecko(asset_id: str, date_str: str, vs_currency: str = "usd")
     - vs_currency: divisa de referencia ('usd', 'eur', etc.)
     """
     
-    url = f"https://api.coingecko.com/api/v3/coins/{asset_id}/history?date={date_str}"
+    url = f"{COINGECKO_API_URL}/coins/{asset_id}/history?date={date_str}"
     print("llamada coingecko:" + str(url))
-    r = requests.get(url)
+    r = get_governor().get(url)
     data = r.json()
     try:
         price = data["market_data"]["current_price"][vs_currency]
@@ -234,25 +551,303 @@ def get_price_coingecko(asset_id: str, date_str: str, vs_currency: str = "usd")
 
 def get_price_binance(symbol: str, datetime_query: str, vs_currency: str = "EUR") -> Decimal:  
     print(f'PARAMETROS CONVERSION!!  SYMBOL{symbol} DATETIME {datetime_query} VSCURRENCY {vs_currency}')
-    if symbol in ("USDC", "USDT"): 
-        return convert_stable_to_fiat(symbol, datetime_query, vs_currency,)
-    return get_binance_close_price(symbol, datetime_query, vs_currency)   
+    return get_price_graph().price(symbol, datetime_query, vs_currency)
+
+
+# ============================
+#   GRAFO DE PARES
+# ============================
+
+_graph: Optional[PriceGraph] = None
+
+
+BINANCE_INVALID_SYMBOL = -1121   # código de error de Binance para un par inexistente
+
+
+def is_invalid_symbol(response) -> bool:
+    """
+    True si la respuesta de Binance dice que el par no existe. Otros 400
+    (parámetros mal formados, rango de fechas...) no cuentan.
+    """
+    if response is None or response.status_code != 400:
+        return False
+    try:
+        return response.json().get("code") == BINANCE_INVALID_SYMBOL
+    except (ValueError, AttributeError):
+        return False
+
+
+def _graph_close_price(symbol: str, datetime_query: str, vs_currency: str) -> Decimal:
+    """
+    get_binance_close_price para el grafo: un 400 de Binance con código
+    -1121 significa que el par no existe y se traduce a PairNotFound.
+    """
+    try:
+        return get_binance_close_price(symbol, datetime_query, vs_currency)
+    except requests.HTTPError as e:
+        if is_invalid_symbol(e.response):
+            raise PairNotFound(symbol.upper(), vs_currency.upper()) from e
+        raise
+
+
+def _pair_missing(symbol: str, quote: str, error: Exception) -> bool:
+    """
+    is_miss de la cadena: un par inexistente en Binance es un fallo de ese
+    nivel y siguen los demás. Se anota en el grafo para no volver a pedirlo.
+    """
+    if isinstance(error, requests.HTTPError) and is_invalid_symbol(error.response):
+        get_price_graph().mark_missing(symbol, quote)
+        return True
+    return False
+
 
+def _graph_fallback_price(asset: str, datetime_query: str, vs_currency: str) -> Optional[Decimal]:
+    """Activos sin ruta de pares: los niveles que sirven cualquier activo (coingecko)."""
+    chain = get_provider_chain()
+    return chain.lookup(asset, vs_currency, datetime_query, only=chain.unlisted_tiers())
 
 
-def convert_stable_to_fiat(symbol_stable: str, datetime_query: str, fiat: str) -> Decimal:
+def get_price_graph() -> PriceGraph:
     """
-    Convierte una stablecoin (USDT, USDC) a EUR o USD usando BTC como puente.
+    Grafo único del proceso. Usa la lista de pares guardada en el almacén
+    (si se ha descargado con refresh_exchange_pairs) y la caché negativa
+    persistente de pares inexistentes.
     """
-    # Precios minuto
-    btc_stable = get_binance_close_price("BTC", datetime_query, vs_currency=symbol_stable)
-    btc_fiat   = get_binance_close_price("BTC", datetime_query, vs_currency=fiat)
+    global _graph
+    if _graph is None:
+        store = get_store()
+        _graph = PriceGraph(
+            _graph_close_price,
+            pairs=store.get_exchange_pairs() or None,
+            missing=store.get_missing_pairs(),
+            on_missing=store.put_missing_pair,
+            fallback=_graph_fallback_price,
+        )
+    return _graph
+
+
+def refresh_exchange_pairs() -> int:
+    """
+    Descarga /api/v3/exchangeInfo (peso 20) y guarda todos los pares,
+    también los retirados, que conservan su histórico de velas.
+    """
+    global _graph
+    data = get_governor().get(f"{BINANCE_API_URL}/api/v3/exchangeInfo", weight=20).json()
+    pairs = {(s["baseAsset"], s["quoteAsset"]) for s in data.get("symbols", [])}
+    n = get_store().replace_exchange_pairs(pairs)
+    _graph = None
+    print(f"Pares de Binance: {n}")
+    return n
+
+
+BINANCE_API_URL = os.environ.get("ARLES_BINANCE_URL", "https://api.binance.com")
+BINANCE_KLINES_URL = f"{BINANCE_API_URL}/api/v3/klines"
+KLINES_LIMIT = 1000  # máximo de velas por llamada
+KLINES_WEIGHT = 2    # peso de /api/v3/klines
+
 
-    return btc_fiat / btc_stable
+def minute_to_ms(datetime_query: str) -> int:
+    """'YYYY-MM-DD HH:MM' -> timestamp en milisegundos."""
+    return int(datetime.strptime(datetime_query, "%Y-%m-%d %H:%M").timestamp() * 1000)
 
 
+def ms_to_minute(ts: int) -> str:
+    """Inversa de minute_to_ms."""
+    return datetime.fromtimestamp(ts / 1000).strftime("%Y-%m-%d %H:%M")
 
 
+def _klines_response(pair: str, start_ts: int, end_ts: int, interval: str = "1m", limit: int = KLINES_LIMIT):
+    url = (
+        f"{BINANCE_KLINES_URL}?"
+        f"symbol={pair}&interval={interval}&startTime={start_ts}&endTime={end_ts}&limit={limit}"
+    )
+    return get_governor().get(url, weight=KLINES_WEIGHT)
+
+
+def fetch_klines(pair: str, start_ts: int, end_ts: int, interval: str = "1m", limit: int = KLINES_LIMIT) -> list:
+    """
+    Descarga las velas de un par entre start_ts y end_ts (ms).
+    Cada vela: [open_time, open, high, low, close, volume, ...]
+    """
+    return _klines_response(pair, start_ts, end_ts, interval, limit).json()
+
+
+def fetch_minute_kline(pair: str, datetime_query: str) -> list:
+    """
+    Velas del minuto solicitado (y el siguiente).
+    """
+    start_ts = minute_to_ms(datetime_query)
+    end_ts = start_ts + 60_000  # 1 minuto después
+    return _klines_response(pair, start_ts, end_ts).json()
+
+
+# ============================
+#   RESOLUCIÓN DE PRECIOS
+# ============================
+
+_resolution_policy = ResolutionPolicy.from_spec(os.environ.get("ARLES_PRICE_RESOLUTION", ""))
+
+
+def configure_resolution(policy):
+    """
+    Política de resolución de la ejecución: un ResolutionPolicy o su texto,
+    p. ej. "asset:BNB=1d, tipo:REWARDS=1d, eur<25=1d".
+    """
+    global _resolution_policy
+    _resolution_policy = ResolutionPolicy.from_spec(policy) if isinstance(policy, str) else policy
+
+
+def get_resolution_policy() -> ResolutionPolicy:
+    return _resolution_policy
+
+
+def bucket_minute(datetime_query: str, interval: str = "1m") -> str:
+    """
+    Minuto clave de la vela de `interval` que contiene datetime_query: su
+    último minuto. El cierre de una vela de 1h o 1d es el cierre de su
+    último minuto, así que la clave cabe en el mismo (symbol, quote, minute)
+    de siempre y todas las filas del intervalo la comparten.
+    """
+    if interval == "1m":
+        return datetime_query
+    step = INTERVAL_MS[interval]
+    ts = minute_to_ms(datetime_query)
+    return ms_to_minute(ts - ts % step + step - 60_000)
+
+
+def leg_intervals(legs, interval: Optional[str] = None) -> list:
+    """
+    Resolución de cada pata de price_legs() según la política activa (o
+    interval para todas). El umbral se evalúa con un precio diario por
+    moneda y día, consultado una sola vez.
+    """
+    if interval is not None:
+        return [interval] * len(legs)
+    policy = get_resolution_policy()
+    daily = {}
+
+    def estimate(coin, amount, minute):
+        key = (coin, bucket_minute(minute, "1d"))
+        if key not in daily:
+            try:
+                daily[key] = get_price_binance(*key)
+            except ValueError:
+                daily[key] = None
+        return None if daily[key] is None else daily[key] * amount_decimal(int(amount))
+
+    return [
+        policy.resolve(coin, tipo, lambda c=coin, a=amount, m=minute: estimate(c, a, m))
+        for coin, amount, tipo, minute in zip(legs["coin"], legs["amount"], legs["tipo"], legs["minute"])
+    ]
+
+
+# ============================
+#   CADENA DE PROVEEDORES
+# ============================
+
+DEFAULT_TIERS = ("memory", "store", "archive", "binance")
+
+_chain: Optional[ProviderChain] = None
+_chain_config = {
+    "tiers": tuple(t for t in os.environ.get("ARLES_PRICE_TIERS", ",".join(DEFAULT_TIERS)).split(",") if t),
+    "offline": os.environ.get("ARLES_OFFLINE", "") not in ("", "0"),
+    "gap_fill": int(os.environ.get("ARLES_GAP_FILL", "0")),      # ±minutos, 0 = desactivado
+}
+_gap_fills: Optional[GapFills] = None
+
+
+def _build_provider(name: str) -> PriceProvider:
+    if name == "memory":
+        return MemoryProvider(get_price_cache())
+    if name == "store":
+        return StoreProvider(get_store())
+    if name == "archive":
+        return ArchiveProvider(get_kline_archive(), minute_to_ms)
+    if name == "binance":
+        return BinanceProvider(fetch_minute_kline, minute_to_ms)
+    if name == "coingecko":
+        return CoinGeckoProvider(get_price_coingecko)
+    raise ValueError(f"Proveedor de precios desconocido: {name}")
+
+
+def configure_providers(
+    tiers: Optional[Sequence[str]] = None, offline: Optional[bool] = None, gap_fill: Optional[int] = None,
+):
+    """
+    Define los niveles de la ejecución por orden de prioridad, p. ej.
+    ("memory", "store", "archive", "binance", "coingecko").
+    offline=True quita todos los niveles de red para re-ejecuciones
+    reproducibles: una clave que falte produce error en vez de descargarse.
+    gap_fill=N activa el relleno de huecos: un minuto sin vela se valora
+    con la vela anterior más cercana dentro de ±N minutos.
+    """
+    global _chain
+    if tiers is not None:
+        _chain_config["tiers"] = tuple(tiers)
+    if offline is not None:
+        _chain_config["offline"] = offline
+    if gap_fill is not None:
+        _chain_config["gap_fill"] = max(0, int(gap_fill))
+    _chain = None
+
+
+def get_gap_fills() -> GapFills:
+    """Registro de huecos rellenados, persistido en el almacén."""
+    global _gap_fills
+    if _gap_fills is None:
+        store = get_store()
+        _gap_fills = GapFills(store.get_gap_fills(), on_record=store.put_gap_fill)
+    return _gap_fills
+
+
+def fetch_gap_window(symbol: str, quote: str, datetime_query: str, window: int) -> list:
+    """
+    Velas de 1 minuto en ±window minutos alrededor de datetime_query (como
+    mucho una llamada de KLINES_LIMIT velas). Todas se guardan en caché.
+    Devuelve [(minuto, cierre)].
+    """
+    ts = minute_to_ms(datetime_query)
+    start_ts = ts - window * 60_000
+    end_ts = min(ts + window * 60_000, start_ts + (KLINES_LIMIT - 1) * 60_000)
+    response = _klines_response(f"{symbol}{quote}".upper(), start_ts, end_ts)
+    cache = get_price_cache()
+    candles = []
+    for candle in response.json():
+        minute, close = ms_to_minute(candle[0]), Decimal(candle[4])
+        cache.put_price(symbol, quote, minute, close)
+        candles.append((minute, close))
+    return candles
+
+
+def gap_fills_for(symbol: str, datetime_query: str, vs_currency: str = "EUR") -> list:
+    """
+    Huecos rellenados que usa el precio de symbol en ese minuto, como
+    "PAR minuto -> minuto servido".
+    """
+    fills = get_gap_fills()
+    notes = []
+    for base, quote, minute in binance_keys_for(symbol, datetime_query, vs_currency):
+        served = fills.get(base, quote, minute)
+        if served is not None:
+            notes.append(f"{base}{quote} {minute} -> {served}")
+    return notes
+
+
+def get_provider_chain() -> ProviderChain:
+    global _chain
+    if _chain is None:
+        providers = [_build_provider(name) for name in _chain_config["tiers"]]
+        if _chain_config["gap_fill"]:
+            # Huecos conocidos antes de la red; el relleno por rango, al final
+            fills = get_gap_fills()
+            first_network = next((i for i, p in enumerate(providers) if p.network), len(providers))
+            providers.insert(first_network, KnownGapProvider(fills, get_price_cache().get_price))
+            providers.append(GapFillProvider(fills, fetch_gap_window, _chain_config["gap_fill"]))
+        if _chain_config["offline"]:
+            providers = [p for p in providers if not p.network]
+        _chain = ProviderChain(providers, remember=get_price_cache().put_price, is_miss=_pair_missing)
+    return _chain
+
 
 def get_binance_close_price(symbol: str, datetime_query: str, vs_currency: str) -> Decimal:
     """
@@ -266,56 +861,331 @@ def get_binance_close_price(symbol: str, datetime_query: str, vs_currency: str)
     Returns:
         Decimal: Precio de cierre del minuto solicitado.
     """
+    # Memoria -> almacén -> archivo offline -> red, según configure_providers
+    return get_provider_chain().get(symbol, vs_currency, datetime_query)
 
-    # --- 1. Preparar caché ---
-    today_str = date.today().isoformat()
-    cache_file = f"binance_prices_{today_str}.json"
 
-    if not os.path.exists(cache_file):
-        backups = [f for f in os.listdir(".") if f.startswith("binance_prices_") and f.endswith(".json")]
-        if backups:
-            backups.sort(reverse=True)
-            shutil.copy(backups[0], cache_file)
+# ============================
+#   DESCARGA CONCURRENTE
+# ============================
 
-    if os.path.exists(cache_file):
-        with open(cache_file, "r", encoding="utf-8") as f:
-            cache = json.load(f)
-    else:
-        cache = {}
+FETCH_WORKERS = int(os.environ.get("ARLES_FETCH_WORKERS", "8"))
 
-    # Clave de caché por minuto exacto
-    key = f"{symbol.upper()}_{vs_currency.upper()}_{datetime_query}"
 
-    if key in cache:
-        return Decimal(str(cache[key]))
+def configure_fetching(max_workers: int):
+    """Límite de peticiones simultáneas de las precargas."""
+    global FETCH_WORKERS
+    FETCH_WORKERS = max(1, int(max_workers))
 
-    # --- 2. Preparar llamada a Binance ---
-    pair = f"{symbol.upper()}{vs_currency.upper()}"
 
-    # Convertir fecha+hora a timestamp
-    dt = datetime.strptime(datetime_query, "%Y-%m-%d %H:%M")
-    start_ts = int(dt.timestamp() * 1000)
-    end_ts = start_ts + 60_000  # 1 minuto después
+def fetch_concurrently(tasks: dict, max_workers: Optional[int] = None) -> dict:
+    """
+    Ejecuta {clave: (func, *args)} en un pool de hilos acotado.
+    Devuelve {clave: resultado o excepción} ordenado por clave, de modo que
+    quien lo consuma aplica los resultados siempre en el mismo orden,
+    sea cual sea el orden en que terminaron las descargas.
+    """
+    if not tasks:
+        return {}
+    workers = min(max_workers or FETCH_WORKERS, len(tasks))
 
-    url = (
-        f"https://api.binance.com/api/v3/klines?"
-        f"symbol={pair}&interval=1m&startTime={start_ts}&endTime={end_ts}"
+    def run(task):
+        func, *args = task
+        try:
+            return func(*args)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {key: pool.submit(run, task) for key, task in tasks.items()}
+        return {key: futures[key].result() for key in sorted(futures)}
+
+
+# ============================
+#   PRECARGA POR RANGOS
+# ============================
+
+def price_minute(utc_time) -> str:
+    """UTC_Time de la fila -> minuto 'YYYY-MM-DD HH:MM' usado como clave."""
+    return pd.to_datetime(utc_time, errors="coerce").strftime("%Y-%m-%d %H:%M")
+
+
+def _needs_price(moneda, cantidad, valor) -> bool:
+    return (
+        bool(moneda) and moneda not in ("EUR", "USD")
+        and cantidad is not None
+        and (pd.isna(valor) or valor == "")
     )
 
-    response = requests.get(url, timeout=10)
-    response.raise_for_status()
-    data = response.json()
 
-    if not data:
-        raise ValueError(f"No hay datos para {pair} en {datetime_query}")
+def price_minutes(utc_times) -> list:
+    """price_minute de cada UTC_Time, calculado una vez por valor distinto."""
+    minutes = {t: price_minute(t) for t in dict.fromkeys(utc_times)}
+    return [minutes[t] for t in utc_times]
 
-    # Vela de 1 minuto: [open_time, open, high, low, close, volume, ...]
-    close_price = Decimal(data[0][4])
 
-    # --- 3. Guardar en caché ---
-    cache[key] = str(close_price)
-    with open(cache_file, "w", encoding="utf-8") as f:
-        json.dump(cache, f, indent=2, sort_keys=True)
+def price_legs(df, with_direct: bool = False):
+    """
+    Patas que hay que valorar con precio de mercado, una fila por pata con
+    pos (posición en df), leg, coin, amount, tipo y minute, en orden
+    Emitido, Recibido, Comision y por posición dentro de cada una.
+    Emitido solo se valora si Recibido tampoco es EUR/USD; si lo es, la
+    pata va en la máscara de valor directo (with_direct=True la devuelve).
+    """
+    needs = {
+        leg: np.fromiter(
+            (_needs_price(m, c, v) for m, c, v in zip(df[f"{leg}_Moneda"], df[f"{leg}_Cantidad"], df[f"{leg}_Valor_EUR"])),
+            dtype=bool, count=len(df),
+        )
+        for leg in LEGS
+    }
+    received_priced = np.fromiter(
+        (bool(m) and m not in ("EUR", "USD") for m in df["Recibido_Moneda"]), dtype=bool, count=len(df)
+    )
+    direct = needs["Emitido"] & ~received_priced
+    needs["Emitido"] = needs["Emitido"] & received_priced
+
+    parts = []
+    for leg in LEGS:
+        pos = np.flatnonzero(needs[leg])
+        parts.append(pd.DataFrame({
+            "pos": pos,
+            "leg": leg,
+            "coin": df[f"{leg}_Moneda"].to_numpy()[pos],
+            "amount": df[f"{leg}_Cantidad"].to_numpy()[pos],
+            "tipo": df["Tipo"].to_numpy()[pos],
+            "utc_time": df["UTC_Time"].to_numpy()[pos],
+        }))
+    legs = pd.concat(parts, ignore_index=True)
+    legs["minute"] = price_minutes(list(legs["utc_time"]))
+    legs = legs.drop(columns="utc_time")
+    return (legs, direct) if with_direct else legs
+
+
+def binance_keys_for(symbol: str, minute: str, vs_currency: str = "EUR") -> list:
+    """
+    Claves (symbol, quote, minute) que get_price_binance consultará.
+    """
+    return get_price_graph().keys_for(symbol, minute, vs_currency)
+
 
-    return close_price
-    
+def collect_binance_price_keys(df, interval: Optional[str] = None) -> set:
+    """
+    Conjunto de claves (symbol, quote, minute, interval) que
+    convert_no_stables_in_df necesitará para el DataFrame, con las mismas
+    patas y la resolución de cada una. Con interval se fuerza esa
+    resolución en todas las patas (precarga de estimaciones).
+    """
+    legs = price_legs(df)
+    keys = set()
+    for coin, minute, leg_interval in set(zip(legs["coin"], legs["minute"], leg_intervals(legs, interval))):
+        keys.update(
+            (base, quote, key_minute, leg_interval)
+            for base, quote, key_minute in binance_keys_for(coin, bucket_minute(minute, leg_interval))
+        )
+    return keys
+
+
+def merge_minute_windows(minutes_ms: list, max_candles: int = KLINES_LIMIT, step_ms: int = 60_000) -> list:
+    """
+    Agrupa timestamps de apertura ordenados en ventanas [inicio, fin] que
+    caben en una sola llamada de max_candles velas de step_ms (1 minuto
+    por defecto).
+    """
+    windows = []
+    for ts in sorted(set(minutes_ms)):
+        if windows and ts - windows[-1][0] < max_candles * step_ms:
+            windows[-1][1] = ts
+        else:
+            windows.append([ts, ts])
+    return [(start, end) for start, end in windows]
+
+
+def prefetch_binance_prices(keys, chunk_size: Optional[int] = None) -> dict:
+    """
+    Descarga de una vez todas las claves que no resuelvan los niveles
+    locales de la cadena (memoria, almacén, archivo): por cada par y
+    resolución fusiona las velas en ventanas de hasta 1000, las descarga en
+    paralelo y guarda todos los cierres devueltos. Un par inexistente o una
+    ventana fallida no aborta: esas claves se resolverán (o fallarán)
+    después, fila a fila.
+    Devuelve {"keys", "missing", "calls", "candles"}.
+    """
+    cache = get_price_cache()
+    chain = get_provider_chain()
+    # Claves (symbol, quote, minute) de 1 minuto o con su resolución
+    keys = {key if len(key) == 4 else (*key, "1m") for key in keys}
+    missing = [
+        (symbol, quote, minute, interval) for symbol, quote, minute, interval in keys
+        if chain.lookup(symbol, quote, minute, network=False) is None
+    ]
+    if not chain.has("binance"):
+        stats = {"keys": len(keys), "missing": len(missing), "calls": 0, "candles": 0}
+        print(f"Precarga Binance desactivada: {stats}")
+        return stats
+
+    # Una clave de 1h/1d es el último minuto de su vela: se pide la vela
+    # de esa resolución por su apertura
+    by_pair = {}
+    for symbol, quote, minute, interval in missing:
+        step = INTERVAL_MS[interval]
+        by_pair.setdefault((symbol.upper(), quote.upper(), interval), []).append(
+            minute_to_ms(minute) + 60_000 - step
+        )
+
+    tasks = {}
+    for (symbol, quote, interval), opens_ms in by_pair.items():
+        for start_ts, end_ts in merge_minute_windows(opens_ms, step_ms=INTERVAL_MS[interval]):
+            tasks[(symbol, quote, interval, start_ts)] = (fetch_klines, f"{symbol}{quote}", start_ts, end_ts, interval)
+
+    # Por tandas: cada tanda se vuelca al almacén al terminar, así una
+    # precarga interrumpida se reanuda sin repetir lo ya descargado.
+    ordered = sorted(tasks)
+    chunk = max(1, chunk_size or FETCH_WORKERS * 4)
+    candles = 0
+    covered = {}                 # (symbol, quote) -> ventanas de 1m descargadas
+    for i in range(0, len(ordered), chunk):
+        results = fetch_concurrently({k: tasks[k] for k in ordered[i:i + chunk]})
+        for (symbol, quote, interval, start_ts), result in results.items():
+            if isinstance(result, Exception):
+                response = getattr(result, "response", None)
+                if is_invalid_symbol(response):
+                    get_price_graph().mark_missing(symbol, quote)
+                print(f"Precarga fallida {symbol}{quote} {interval} {ms_to_minute(start_ts)}: {result}")
+                continue
+            close_offset = INTERVAL_MS[interval] - 60_000
+            for candle in result:
+                cache.put_price(symbol, quote, ms_to_minute(candle[0] + close_offset), Decimal(candle[4]))
+            candles += len(result)
+            if interval == "1m":
+                covered.setdefault((symbol, quote), []).append(tasks[(symbol, quote, interval, start_ts)][2:4])
+        cache.flush()
+    calls = len(tasks)
+
+    stats = {"keys": len(keys), "missing": len(missing), "calls": calls, "candles": candles}
+    if _chain_config["gap_fill"]:
+        stats["gaps"], gap_calls = fill_gaps(missing, covered)
+        stats["calls"] += gap_calls
+    print(f"Precarga Binance: {stats}")
+    return stats
+
+
+def fill_gaps(keys, covered: Optional[dict] = None) -> tuple:
+    """
+    Rellena con la vela anterior más cercana las claves que siguen sin
+    precio tras la precarga. Si el hueco cae en una ventana de 1 minuto ya
+    descargada (covered: {(symbol, quote): [(inicio, fin)]}) y la vela
+    anterior también, no hace falta pedir nada; si no, una petición por
+    rango por clave. Los pares inexistentes no se intentan.
+    Devuelve (huecos rellenados, llamadas).
+    """
+    cache = get_price_cache()
+    chain = get_provider_chain()
+    graph = get_price_graph()
+    fills = get_gap_fills()
+    window = _chain_config["gap_fill"]
+
+    pending = sorted(
+        key[:3] for key in keys
+        if (key[0].upper(), key[1].upper()) not in graph.missing
+        and chain.lookup(*key[:3], network=False) is None
+    )
+    filled, tasks = 0, {}
+    for symbol, quote, minute in pending:
+        ts = minute_to_ms(minute)
+        start = next((s for s, e in covered.get((symbol, quote), ()) if s <= ts <= e), None) if covered else None
+        nearest = cache.nearest_price(symbol, quote, minute, window) if start is not None else None
+        if nearest is not None and minute_to_ms(nearest[0]) >= start:
+            fills.record(symbol, quote, minute, nearest[0])
+            filled += 1
+        elif chain.has("gapfill"):
+            tasks[(symbol, quote, minute)] = (chain.lookup, symbol, quote, minute, True, ("gapfill",))
+
+    for key, result in fetch_concurrently(tasks).items():
+        if isinstance(result, Exception) or result is None:
+            print(f"Hueco sin vela cercana {''.join(key[:2])} {key[2]}: {result}")
+            continue
+        filled += 1
+    return filled, len(tasks)
+
+
+def prefetch_df_prices(df, max_rounds: int = 3) -> dict:
+    """
+    Precarga las claves Binance de un DataFrame. Si en la precarga aparecen
+    pares inexistentes, las rutas del grafo cambian y se repite con las
+    claves nuevas (como mucho max_rounds veces).
+    """
+    graph = get_price_graph()
+    stats = {}
+    for _ in range(max_rounds):
+        n_missing = len(graph.missing)
+        if get_resolution_policy().threshold_eur is not None:
+            # El umbral se evalúa a precio diario: una vela 1d por par y día,
+            # con las rutas ya estables antes de elegir resoluciones
+            prefetch_binance_prices(collect_binance_price_keys(df, interval="1d"))
+            if len(graph.missing) != n_missing:
+                continue
+        stats = prefetch_binance_prices(collect_binance_price_keys(df))
+        if len(graph.missing) == n_missing:
+            break
+    return stats
+
+
+def collect_usd_eur_days(df) -> set:
+    """
+    Fechas 'YYYY-MM-DD' que convert_stables_in_df consultará: las de
+    filas con alguna pata en USDC/USDT.
+    """
+    _, any_stable = _stable_masks(df)
+    return {str(t)[:10] for t in df.loc[any_stable, "UTC_Time"]}
+
+
+def prefetch_usd_eur_rates(days) -> dict:
+    """
+    Carga con una sola llamada a Frankfurter el histórico que cubre los
+    días que falten en caché. Si aun así queda alguno (p. ej. la serie
+    temporal falla), se descargan día a día en paralelo.
+    Devuelve {"days", "missing", "calls"}.
+    """
+    cache = get_price_cache()
+
+    def pending(candidates):
+        return sorted(d for d in candidates if get_local_usd_to_eur_rate(d) is None)
+
+    missing = pending(set(days))
+    calls = 0
+    if _chain_config["offline"]:
+        stats = {"days": len(set(days)), "missing": len(missing), "calls": 0}
+        print(f"Precarga USD/EUR desactivada: {stats}")
+        return stats
+    if missing:
+        calls += 1
+        # Unos días antes del primero: si cae en fin de semana o festivo,
+        # necesita la última publicación anterior para arrastrarla
+        start = (date.fromisoformat(missing[0]) - timedelta(days=USD_EUR_LOOKBACK_DAYS)).isoformat()
+        try:
+            load_usd_eur_history(start, missing[-1])
+        except Exception as e:
+            print(f"Histórico USD/EUR fallido {start}..{missing[-1]}: {e}")
+
+    # Lo cubierto por el histórico también va al almacén, para que la
+    # ejecución real en otro proceso no lo vuelva a pedir
+    if _usd_eur_history is not None:
+        for day in missing:
+            rate = _usd_eur_history.rate(day)
+            if rate is not None:
+                cache.put_rate(day, rate)
+
+    remaining = pending(missing)
+    results = fetch_concurrently({d: (fetch_usd_eur_rate, d) for d in remaining})
+    for day, result in results.items():
+        if isinstance(result, Exception):
+            print(f"Precarga USD/EUR fallida {day}: {result}")
+            continue
+        cache.put_rate(day, result)
+    calls += len(remaining)
+
+    cache.flush()
+    stats = {"days": len(set(days)), "missing": len(missing), "calls": calls}
+    print(f"Precarga USD/EUR: {stats}")
+    return stats
@@ -0,0 +1,205 @@
+"""
+Cierres anuales del estado FIFO.
+
+Al terminar cada año ya cerrado (31 de diciembre) se guarda la cola de
+lotes de cada cripto en un fichero JSON compacto, junto con el número de
+filas hasta ese cierre, un checksum de su contenido y los resultados FIFO
+de las filas del año. Una ejecución posterior parte del último cierre
+cuyo checksum coincide con las filas actuales y solo pasa por
+procesar_df_con_fifo las filas posteriores; las anteriores recuperan sus
+resultados de los cierres, así que la salida no cambia. Si alguna fila
+anterior al cierre cambia (exportación corregida, precios distintos...),
+el checksum no coincide y se usa un cierre anterior o se empieza de cero.
+
+    ARLES_FIFO_CHECKPOINTS=fifo_cierres   directorio de cierres (vacío = desactivado)
+"""
+import hashlib
+import json
+import math
+import os
+from collections import deque
+from datetime import date
+from numbers import Integral
+from typing import Optional
+
+import pandas as pd
+
+from modulo_procesos_calculos import procesar_df_con_fifo, procesar_df_con_fifo_paralelo
+from pila_fifo import CryptoFIFO, Lote
+
+FIFO_CHECKPOINTS = os.environ.get("ARLES_FIFO_CHECKPOINTS", "")
+
+FORMAT_VERSION = 2
+
+# Columnas de entrada de las que depende el estado FIFO
+COLUMNAS_CHECKSUM = (
+    "UTC_Time", "Tipo", "Declarable",
+    "Emitido_Moneda", "Emitido_Cantidad", "Emitido_Valor_EUR",
+    "Recibido_Moneda", "Recibido_Cantidad", "Recibido_Valor_EUR",
+)
+COLUMNAS_RESULTADO = ("Valor Adquisicion", "Valor Transmision", "Detalle FIFO")
+
+
+def _campo(value) -> str:
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ""
+    if isinstance(value, Integral):
+        return str(int(value))
+    return str(value)
+
+
+def _campo_json(value):
+    if value is None or isinstance(value, (str, Integral)):
+        return value
+    return str(value)
+
+
+def _anio(utc_time) -> int:
+    return int(str(utc_time)[:4])
+
+
+def checksums_por_anio(df) -> dict:
+    """
+    {año: (filas, checksum)} con el sha256 acumulado de todas las filas
+    hasta el final de cada año, en orden. Las filas deben estar en orden
+    cronológico.
+    """
+    sha = hashlib.sha256()
+    checksums = {}
+    columnas = [df[c].tolist() for c in COLUMNAS_CHECKSUM]
+    anio_previo = None
+    for pos, fila in enumerate(zip(*columnas)):
+        anio = _anio(fila[0])
+        if anio_previo is not None and anio != anio_previo:
+            checksums[anio_previo] = (pos, sha.hexdigest())
+        sha.update("\x1f".join(_campo(v) for v in fila).encode())
+        sha.update(b"\x1e")
+        anio_previo = anio
+    if anio_previo is not None:
+        checksums[anio_previo] = (len(df), sha.hexdigest())
+    return checksums
+
+
+def _ruta(directorio: str, anio: int) -> str:
+    return os.path.join(directorio, f"fifo_cierre_{anio}.json")
+
+
+def estado_fifo(fifo: CryptoFIFO) -> dict:
+    """Lotes de cada cripto como listas JSON: [fecha, cantidad 1e-8, coste 1e-10]."""
+    return {
+        cripto: [[str(l.fecha), l.cantidad, l.coste] for l in cola]
+        for cripto, cola in fifo.lotes.items()
+    }
+
+
+def guardar_cierre(directorio: str, anio: int, filas: int, checksum: str, fifo: CryptoFIFO,
+                   resultados: dict):
+    """
+    Escribe el estado de fifo al cierre de anio y resultados, {columna:
+    valores} de las filas del año (escritura atómica).
+    """
+    os.makedirs(directorio, exist_ok=True)
+    datos = {
+        "version": FORMAT_VERSION,
+        "anio": anio,
+        "filas": filas,
+        "checksum": checksum,
+        "lotes": estado_fifo(fifo),
+        # El detalle (DetalleFIFO) se guarda ya como texto, como al exportar
+        "resultados": {c: [_campo_json(v) for v in resultados[c]] for c in COLUMNAS_RESULTADO},
+    }
+    ruta = _ruta(directorio, anio)
+    tmp = f"{ruta}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(datos, f, separators=(",", ":"))
+    os.replace(tmp, ruta)
+
+
+def cargar_cierre(directorio: str, anio: int) -> Optional[dict]:
+    try:
+        with open(_ruta(directorio, anio), "r", encoding="utf-8") as f:
+            datos = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return datos if datos.get("version") == FORMAT_VERSION else None
+
+
+def cierres_validos(directorio: str, checksums: dict) -> list:
+    """
+    Cierres seguidos desde el primer año cuyo número de filas y checksum
+    coinciden y que traen los resultados de todas las filas de su año. El
+    último es el más reciente desde el que se puede seguir.
+    """
+    cierres = []
+    filas_previas = 0
+    for anio in sorted(checksums):
+        datos = cargar_cierre(directorio, anio)
+        if datos is None or (datos["filas"], datos["checksum"]) != checksums[anio]:
+            break
+        if any(len(datos["resultados"][c]) != datos["filas"] - filas_previas for c in COLUMNAS_RESULTADO):
+            break
+        cierres.append(datos)
+        filas_previas = datos["filas"]
+    return cierres
+
+
+def restaurar_fifo(fifo: CryptoFIFO, datos: dict):
+    fifo.lotes.clear()
+    for cripto, lotes in datos["lotes"].items():
+        fifo.lotes[cripto] = deque(Lote(fecha, cantidad, coste) for fecha, cantidad, coste in lotes)
+
+
+def procesar_df_con_fifo_por_anios(df, fifo: CryptoFIFO, directorio: str, workers: int = 1,
+                                   anio_actual: Optional[int] = None) -> int:
+    """
+    procesar_df_con_fifo año a año, desde el último cierre válido de
+    directorio, guardando un cierre al terminar cada año anterior a
+    anio_actual (por defecto, el año en curso). Las filas anteriores al
+    cierre usado toman sus resultados de los cierres: df sale completo.
+    Devuelve la posición de la primera fila que ha pasado por el FIFO.
+    Si las filas no están en orden de años se procesa todo sin cierres.
+    """
+    anio_actual = anio_actual or date.today().year
+    anios = [_anio(t) for t in df["UTC_Time"]]
+    resultados = {c: [None] * len(df) for c in COLUMNAS_RESULTADO}
+
+    if any(a > b for a, b in zip(anios, anios[1:])):
+        print("Filas fuera de orden cronológico: FIFO completo, sin cierres")
+        checksums, inicio = {}, 0
+        tramos = [(0, len(df))]
+    else:
+        checksums = checksums_por_anio(df)
+        inicio = 0
+        cierres = cierres_validos(directorio, checksums)
+        if cierres:
+            cierre = cierres[-1]
+            restaurar_fifo(fifo, cierre)
+            inicio = cierre["filas"]
+            for columna in COLUMNAS_RESULTADO:
+                resultados[columna][:inicio] = [v for c in cierres for v in c["resultados"][columna]]
+            print(f"FIFO desde el cierre de {cierre['anio']}: {inicio} filas ya procesadas")
+        tramos = []
+        pos = inicio
+        for anio in sorted(a for a in checksums if checksums[a][0] > inicio):
+            tramos.append((pos, checksums[anio][0]))
+            pos = checksums[anio][0]
+
+    for desde, hasta in tramos:
+        tramo = df.iloc[desde:hasta].copy()
+        if workers > 1:
+            procesar_df_con_fifo_paralelo(tramo, fifo, workers)
+        else:
+            procesar_df_con_fifo(tramo, fifo)
+        for columna in COLUMNAS_RESULTADO:
+            resultados[columna][desde:hasta] = tramo[columna].tolist()
+
+        anio = anios[desde]
+        if checksums and anio < anio_actual:
+            guardar_cierre(
+                directorio, anio, *checksums[anio], fifo,
+                {c: resultados[c][desde:hasta] for c in COLUMNAS_RESULTADO},
+            )
+
+    for columna in COLUMNAS_RESULTADO:
+        df[columna] = pd.Series(resultados[columna], index=df.index, dtype=object)
+    return inicio
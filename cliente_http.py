@@ -0,0 +1,119 @@
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+POOL_SIZE = int(os.environ.get("ARLES_HTTP_POOL", "16"))
+DEFAULT_TIMEOUT: Tuple[float, float] = (5.0, 15.0)   # (conexión, lectura)
+
+
+class HostStats:
+    """Latencias de un host en milisegundos."""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.bytes = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, elapsed_ms: float, n_bytes: int = 0, error: bool = False):
+        self.requests += 1
+        self.errors += int(error)
+        self.bytes += n_bytes
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "bytes": self.bytes,
+            "avg_ms": round(self.total_ms / self.requests, 1) if self.requests else 0.0,
+            "max_ms": round(self.max_ms, 1),
+        }
+
+
+class ProviderClient:
+    """
+    Cliente HTTP compartido por los proveedores de precios.
+
+    Mantiene una requests.Session por host con conexiones keep-alive
+    reutilizables (pool de pool_size), gzip y timeout por defecto,
+    y acumula estadísticas de latencia por host.
+    """
+
+    def __init__(self, pool_size: int = POOL_SIZE, timeout: Tuple[float, float] = DEFAULT_TIMEOUT):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.sessions: Dict[str, requests.Session] = {}
+        self.host_stats: Dict[str, HostStats] = {}
+        self._lock = threading.Lock()
+
+    def _session(self, host: str) -> requests.Session:
+        with self._lock:
+            session = self.sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=self.pool_size,
+                    pool_block=True,
+                    max_retries=0,          # los reintentos son cosa del regulador
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update({
+                    "Accept-Encoding": "gzip, deflate",
+                    "Connection": "keep-alive",
+                })
+                self.sessions[host] = session
+                self.host_stats[host] = HostStats()
+            return session
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        host = urlparse(url).netloc
+        session = self._session(host)
+        kwargs.setdefault("timeout", self.timeout)
+
+        start = time.perf_counter()
+        try:
+            response = session.get(url, **kwargs)
+        except requests.RequestException:
+            self._record(host, start, 0, error=True)
+            raise
+        self._record(host, start, len(response.content), error=response.status_code >= 400)
+        return response
+
+    def _record(self, host: str, start: float, n_bytes: int, error: bool):
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.host_stats[host].record(elapsed_ms, n_bytes, error)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {host: s.as_dict() for host, s in sorted(self.host_stats.items())}
+
+    def close(self):
+        with self._lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions.clear()
+
+
+_client: Optional[ProviderClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> ProviderClient:
+    """Cliente único del proceso."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = ProviderClient()
+        return _client
@@ -1,5 +1,7 @@
 import pandas as pd
-from decimal import Decimal
+from numbers import Integral
+
+from punto_fijo import amount_decimal, eur_decimal, to_eur
 
 
 # ============================
@@ -11,11 +13,20 @@ def extraer_anio(utc_time_str: str) -> int:
     return int(str(utc_time_str)[:4])
 
 
-def obtener_comision_eur(row) -> Decimal:
-    """Devuelve la comisión en EUR si existe, si no 0."""
+def valor_eur(value) -> int:
+    """Valor EUR de una celda en punto fijo (unidades de 1e-10); ausente -> 0."""
+    if value in (None, ""):
+        return 0
+    if isinstance(value, Integral):
+        return int(value)
+    return to_eur(value) or 0
+
+
+def obtener_comision_eur(row) -> int:
+    """Devuelve la comisión en EUR (punto fijo) si existe, si no 0."""
     if row.get("Comision_Valor_EUR") not in (None, "", 0):
-        return Decimal(str(row["Comision_Valor_EUR"]))
-    return Decimal("0")
+        return valor_eur(row["Comision_Valor_EUR"])
+    return 0
 
 
 def es_compra(row) -> bool:
@@ -37,6 +48,7 @@ def calcular_totales_base_ahorro(df: pd.DataFrame) -> dict:
       - valor total de transmisión
       - valor total de adquisición
     siguiendo los criterios fiscales definidos por Arles.
+    Los importes se acumulan en punto fijo (unidades de 1e-10 EUR).
     """
 
     # Filtrar solo filas declarables
@@ -60,11 +72,11 @@ def calcular_totales_base_ahorro(df: pd.DataFrame) -> dict:
         if key not in totales:
             totales[key] = {
                 "n_ops_emitida": 0,
-                "v_emision_moneda": Decimal("0"),
-                "transmision": Decimal("0"),
-                "adquisicion": Decimal("0"),
-                "comision": Decimal("0"),
-                "comision_compra": Decimal("0"),
+                "v_emision_moneda": 0,
+                "transmision": 0,
+                "adquisicion": 0,
+                "comision": 0,
+                "comision_compra": 0,
             }
 
         # Contar operación
@@ -72,7 +84,7 @@ def calcular_totales_base_ahorro(df: pd.DataFrame) -> dict:
         
         v_emision_moneda = row.get("Emitido_Valor_EUR")
         if v_emision_moneda not in (None, ""):
-            totales[key]["v_emision_moneda"] += Decimal(str(v_emision_moneda))
+            totales[key]["v_emision_moneda"] += valor_eur(v_emision_moneda)
 
         # ============================
         #   TRANSMISIÓN
@@ -80,21 +92,21 @@ def calcular_totales_base_ahorro(df: pd.DataFrame) -> dict:
         # Valor de transmisión = Valor Transmision
         valor_tr = row.get("Valor Transmision")
         if valor_tr not in (None, ""):
-            totales[key]["transmision"] += Decimal(str(valor_tr))            
+            totales[key]["transmision"] += valor_eur(valor_tr)            
         # ============================
         #   ADQUISICIÓN
         # ============================
         comision_eur = obtener_comision_eur(row)
         valor_adq = row.get("Valor Adquisicion")
-        valor_adq_dec = Decimal(str(valor_adq)) if valor_adq not in (None, "") else Decimal("0")
-        print(f"Un valor sumado a comision {moneda} cantidad {cantidad} y comision {str(comision_eur)}")
+        valor_adq_dec = valor_eur(valor_adq)
+        print(f"Un valor sumado a comision {moneda} cantidad {amount_decimal(cantidad) if isinstance(cantidad, Integral) else cantidad} y comision {str(eur_decimal(comision_eur))}")
         # A) PERMUTAS → adquisición = Valor Adquisicion + comisión EUR
         if es_permuta_o_venta(row):
             totales[key]["adquisicion"] += valor_adq_dec
             totales[key]["comision"] += comision_eur
 
         # B) COMPRAS → adquisición = comisión EUR
-        elif es_compra(row) and comision_eur != Decimal("0"):
+        elif es_compra(row) and comision_eur != 0:
             totales[key]["adquisicion"] += comision_eur
             
     for _, row in df.iterrows():
@@ -111,13 +123,13 @@ def calcular_totales_base_ahorro(df: pd.DataFrame) -> dict:
         if key not in totales:
             totales[key] = {
                 "n_ops_emitida": 0,
-                "v_emision_moneda": Decimal("0"),
-                "transmision": Decimal("0"),
-                "adquisicion": Decimal("0"),
-                "comision": Decimal("0"),
-                "comision_compra": Decimal("0"),
+                "v_emision_moneda": 0,
+                "transmision": 0,
+                "adquisicion": 0,
+                "comision": 0,
+                "comision_compra": 0,
             }
-        print(f"*****************METO COMISION COMPRA********* -> {moneda} {anio} {comision_eur}" )
+        print(f"*****************METO COMISION COMPRA********* -> {moneda} {anio} {eur_decimal(comision_eur)}" )
         totales[key]["comision_compra"] += comision_eur      
         
              
@@ -142,10 +154,10 @@ def generar_informe_txt_base_ahorro(totales: dict) -> str:
     for (anio, moneda) in claves_ordenadas:
         datos = totales[(anio, moneda)]
         n_ops = datos["n_ops_emitida"]
-        tr = datos["transmision"]
-        adq = datos["adquisicion"]
-        comisiones = datos["comision"]
-        comisiones_compra  = datos["comision_compra"]
+        tr = eur_decimal(datos["transmision"])
+        adq = eur_decimal(datos["adquisicion"])
+        comisiones = eur_decimal(datos["comision"])
+        comisiones_compra  = eur_decimal(datos["comision_compra"])
         if anio != anio_actual:
             if anio_actual is not None:
                 lineas.append("")
@@ -171,7 +183,9 @@ def generar_informe_txt_base_ahorro(totales: dict) -> str:
         lineas.append("  Comision en operaciones (EUR):")
         lineas.append("    = sumatorio de comisiones derivadas en operaciones en las que se redibe esta moneda.")
         lineas.append(f"    => {comisiones_compra}")       
-        gp = tr - (adq + comisiones + comisiones_compra)
+        gp = eur_decimal(
+            datos["transmision"] - (datos["adquisicion"] + datos["comision"] + datos["comision_compra"])
+        )
         lineas.append("  Ganancia/Pérdida patrimonial (EUR):")
         lineas.append("    = Transmisión - (Adquisición + Comisiones emision + Comisiones recepción")
         lineas.append(f"    => {gp}")
@@ -190,4 +204,50 @@ def generar_informe_fiscal_base_ahorro_txt(df: pd.DataFrame) -> str:
     """
     totales = calcular_totales_base_ahorro(df)
     informe = generar_informe_txt_base_ahorro(totales)
-    return informe
\ No newline at end of file
+    return informe
+
+# ============================
+#   COMPARATIVA DE MÉTODOS
+# ============================
+
+def calcular_totales_metodos(df: pd.DataFrame, metodos) -> dict:
+    """
+    Por año, transmisión (Valor Transmision del FIFO) y adquisición de cada
+    método (columnas 'Valor Adquisicion <método>' de metodos_coste) en las
+    filas declarables donde se emite una moneda (VENTA y PERMUTA). En
+    punto fijo.
+    """
+    df = df[(df["Declarable"] == "S") & df["Tipo"].isin(("VENTA", "PERMUTA"))]
+
+    totales = {}
+    anios = [extraer_anio(t) for t in df["UTC_Time"]]
+    transmision = [valor_eur(v) for v in df["Valor Transmision"]]
+    for i, anio in enumerate(anios):
+        datos = totales.setdefault(anio, {"transmision": 0, "adquisicion": {m: 0 for m in metodos}})
+        datos["transmision"] += transmision[i]
+    for metodo in metodos:
+        for anio, valor in zip(anios, df[f"Valor Adquisicion {metodo}"]):
+            totales[anio]["adquisicion"][metodo] += valor_eur(valor)
+    return totales
+
+
+def generar_comparativa_metodos_txt(df: pd.DataFrame, metodos) -> str:
+    """
+    Ganancia/pérdida por año con cada método de coste. Las comisiones no
+    dependen del método y no se incluyen: la diferencia entre métodos es
+    la misma con ellas.
+    """
+    totales = calcular_totales_metodos(df, metodos)
+    lineas = []
+    for anio in sorted(totales):
+        datos = totales[anio]
+        lineas.append(f"===== AÑO {anio} =====")
+        lineas.append(f"  Valor total de TRANSMISIÓN (EUR): {eur_decimal(datos['transmision'])}")
+        for metodo in metodos:
+            adq = datos["adquisicion"][metodo]
+            lineas.append(
+                f"  {metodo:<6} adquisición {eur_decimal(adq)}"
+                f"  ganancia/pérdida {eur_decimal(datos['transmision'] - adq)}"
+            )
+        lineas.append("")
+    return "\n".join(lineas)
@@ -0,0 +1,139 @@
+import threading
+from collections import deque
+from decimal import Decimal
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+
+# Monedas que pueden hacer de puente, por orden de preferencia en empates
+BRIDGE_QUOTES = ("EUR", "USDT", "USDC", "BTC", "BNB")
+
+Pair = Tuple[str, str]              # (base, quote) como en Binance: BTCEUR -> ("BTC", "EUR")
+Step = Tuple[str, str, bool]        # (base, quote, invertido)
+
+
+class PairNotFound(LookupError):
+    """El exchange no lista el par (Binance responde 400 Invalid symbol)."""
+
+
+class PriceGraph:
+    """
+    Grafo de conversión entre activos sobre los pares de Binance.
+
+    Cada par BASEQUOTE da una arista BASE -> QUOTE (precio de cierre) y la
+    inversa QUOTE -> BASE (1 / precio). Para cada activo se busca el camino
+    hasta la moneda destino con menos consultas de precio, pasando solo por
+    BRIDGE_QUOTES, y se memoriza para reutilizarlo en todas sus filas.
+
+    Si se conoce la lista de pares del exchange solo se usan esos; si no,
+    se prueban los candidatos y los que resultan no existir quedan en la
+    caché negativa (missing) para no volver a pedirlos.
+
+    fallback(asset, minute, target) da el precio de un activo sin camino
+    (p. ej. CoinGecko), o None.
+    """
+
+    def __init__(
+        self,
+        price_fn: Callable[[str, str, str], Decimal],
+        pairs: Optional[Iterable[Pair]] = None,
+        missing: Optional[Iterable[Pair]] = None,
+        on_missing: Optional[Callable[[str, str], None]] = None,
+        fallback: Optional[Callable[[str, str, str], Optional[Decimal]]] = None,
+    ):
+        self.price_fn = price_fn
+        self.pairs: Optional[Set[Pair]] = set(pairs) if pairs is not None else None
+        self.missing: Set[Pair] = set(missing or ())
+        self.on_missing = on_missing
+        self.fallback = fallback
+        self._paths: Dict[Tuple[str, str], Optional[List[Step]]] = {}
+        self._lock = threading.Lock()
+
+    def _pair_available(self, base: str, quote: str) -> bool:
+        if (base, quote) in self.missing:
+            return False
+        return self.pairs is None or (base, quote) in self.pairs
+
+    def _neighbours(self, asset: str, nodes: Tuple[str, ...]) -> List[Tuple[str, Step]]:
+        result = []
+        for other in nodes:
+            if other == asset:
+                continue
+            if self._pair_available(asset, other):
+                result.append((other, (asset, other, False)))
+            elif self._pair_available(other, asset):
+                result.append((other, (other, asset, True)))
+        return result
+
+    def path(self, asset: str, target: str = "EUR") -> Optional[List[Step]]:
+        """
+        Camino más barato (menos pares) de asset a target, o None.
+        """
+        asset, target = asset.upper(), target.upper()
+        key = (asset, target)
+        with self._lock:
+            if key in self._paths:
+                return self._paths[key]
+
+            nodes = tuple(dict.fromkeys((target, *BRIDGE_QUOTES, asset)))
+            previous: Dict[str, Tuple[str, Step]] = {}
+            seen = {asset}
+            queue = deque([asset])
+            while queue:
+                node = queue.popleft()
+                if node == target:
+                    break
+                for other, step in self._neighbours(node, nodes):
+                    if other not in seen:
+                        seen.add(other)
+                        previous[other] = (node, step)
+                        queue.append(other)
+
+            if target not in seen:
+                found = None
+            else:
+                found = []
+                node = target
+                while node != asset:
+                    node, step = previous[node]
+                    found.append(step)
+                found.reverse()
+
+            self._paths[key] = found
+            return found
+
+    def mark_missing(self, base: str, quote: str):
+        """Registra un par inexistente y olvida los caminos memorizados."""
+        pair = (base.upper(), quote.upper())
+        with self._lock:
+            if pair in self.missing:
+                return
+            self.missing.add(pair)
+            self._paths.clear()
+        if self.on_missing:
+            self.on_missing(*pair)
+
+    def keys_for(self, asset: str, minute: str, target: str = "EUR") -> List[Tuple[str, str, str]]:
+        """Claves (symbol, quote, minute) que consultará price()."""
+        return [(base, quote, minute) for base, quote, _ in self.path(asset, target) or []]
+
+    def price(self, asset: str, minute: str, target: str = "EUR") -> Decimal:
+        """
+        Precio de asset en target en ese minuto siguiendo el camino
+        memorizado. Si un par resulta no existir se recalcula el camino; si
+        no queda ninguno se pregunta a fallback.
+        """
+        while True:
+            steps = self.path(asset, target)
+            if steps is None:
+                value = self.fallback(asset, minute, target) if self.fallback else None
+                if value is not None:
+                    return value
+                raise ValueError(f"No hay ruta de precio para {asset} -> {target}")
+            try:
+                value = Decimal(1)
+                for base, quote, inverted in steps:
+                    close = self.price_fn(base, minute, quote)
+                    value = value / close if inverted else value * close
+                return value
+            except PairNotFound as e:
+                self.mark_missing(*e.args[:2])
@@ -0,0 +1,202 @@
+"""
+Modo incremental: libro valorado persistente con marca de agua UTC_Time.
+
+En cada ejecución solo se valoran y pasan por FIFO las filas nuevas:
+
+    - filas posteriores a la marca de agua (la última UTC_Time del libro):
+      se añaden al final y el FIFO sigue desde el estado guardado tras la
+      última fila;
+    - filas anteriores a la marca que el libro no tiene (historia
+      corregida): se insertan en su sitio y el FIFO rebobina al último
+      cierre anual válido anterior (cierres_fifo).
+
+Las filas ya presentes en el libro se reconocen por sus columnas de
+entrada y se ignoran, así que da igual recibir solo el mes nuevo o la
+exportación completa. Las filas que desaparecen de una exportación no se
+borran del libro: para eso hay que borrar el directorio y empezar de cero.
+
+Los totales del informe se guardan por (año, moneda) y solo se recalculan
+los años desde la primera fila afectada.
+
+    ARLES_LEDGER_DIR=libro   directorio del libro (vacío = desactivado)
+        libro.pkl            filas valoradas con sus resultados FIFO
+        estado.json          marca de agua, estado FIFO final y totales
+        cierres/             cierres anuales FIFO
+"""
+import json
+import os
+from collections import Counter
+from typing import Optional, Tuple
+
+import pandas as pd
+
+from bce_api import convert_no_stables_in_df, prefetch_df_prices
+from cierres_fifo import (
+    COLUMNAS_RESULTADO, checksums_por_anio, estado_fifo, procesar_df_con_fifo_por_anios, restaurar_fifo,
+)
+from generador_informes import calcular_totales_base_ahorro, extraer_anio
+from modulo_procesos_calculos import procesar_df_con_fifo, procesar_df_con_fifo_paralelo
+from pila_fifo import CryptoFIFO
+
+LEDGER_DIR = os.environ.get("ARLES_LEDGER_DIR", "")
+
+FORMAT_VERSION = 1
+
+# Columnas que identifican una fila de la exportación antes de valorarla
+COLUMNAS_CLAVE = (
+    "UTC_Time", "Tracker", "Tipo",
+    "Emitido_Moneda", "Emitido_Cantidad",
+    "Recibido_Moneda", "Recibido_Cantidad",
+    "Comision_Moneda", "Comision_Cantidad",
+    "Declarable",
+)
+
+
+def _instantes(utc_times) -> list:
+    """
+    UTC_Time -> 'YYYY-MM-DD HH:MM:SS' en UTC, comparable como texto. Las
+    filas de Coinbase traen otros formatos ('...Z', '... UTC').
+    """
+    instantes = {
+        t: pd.to_datetime(str(t), utc=True).strftime("%Y-%m-%d %H:%M:%S")
+        for t in dict.fromkeys(utc_times)
+    }
+    return [instantes[t] for t in utc_times]
+
+
+def _clave(fila) -> tuple:
+    return tuple(None if pd.isna(v) else v for v in fila)
+
+
+def _claves(df) -> list:
+    return [_clave(f) for f in zip(*(df[c].tolist() for c in COLUMNAS_CLAVE))]
+
+
+def _checksum(df) -> Optional[list]:
+    """(filas, checksum) de todas las filas, el del último año."""
+    checksums = checksums_por_anio(df)
+    return list(checksums[max(checksums)]) if checksums else None
+
+
+class LibroIncremental:
+    """Libro valorado y estado persistentes en un directorio."""
+
+    def __init__(self, directorio: str):
+        self.directorio = directorio
+        self.ruta_libro = os.path.join(directorio, "libro.pkl")
+        self.ruta_estado = os.path.join(directorio, "estado.json")
+        self.dir_cierres = os.path.join(directorio, "cierres")
+
+    def cargar(self) -> Tuple[Optional[pd.DataFrame], dict]:
+        if not os.path.exists(self.ruta_libro):
+            return None, {}
+        libro = pd.read_pickle(self.ruta_libro)
+        try:
+            with open(self.ruta_estado, "r", encoding="utf-8") as f:
+                estado = json.load(f)
+        except (OSError, ValueError):
+            estado = {}
+        if estado.get("version") != FORMAT_VERSION:
+            estado = {}
+        return libro, estado
+
+    def guardar(self, libro: pd.DataFrame, fifo: CryptoFIFO, totales: dict):
+        os.makedirs(self.directorio, exist_ok=True)
+        tmp = f"{self.ruta_libro}.tmp"
+        libro.to_pickle(tmp)
+        os.replace(tmp, self.ruta_libro)
+
+        estado = {
+            "version": FORMAT_VERSION,
+            "marca_agua": max(_instantes(libro["UTC_Time"].tolist())) if len(libro) else None,
+            "checksum": _checksum(libro),
+            "lotes": estado_fifo(fifo),
+            "totales": [[anio, moneda, datos] for (anio, moneda), datos in totales.items()],
+        }
+        tmp = f"{self.ruta_estado}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(estado, f, separators=(",", ":"))
+        os.replace(tmp, self.ruta_estado)
+
+
+def actualizar_libro(df, directorio: str, workers: int = 1) -> Tuple[pd.DataFrame, dict]:
+    """
+    Añade al libro de directorio las filas nuevas de df (DataFrame de
+    build_dataframe, sin valorar) y devuelve el libro completo valorado,
+    con Valor Adquisicion / Valor Transmision / Detalle FIFO, y los totales
+    de calcular_totales_base_ahorro de todos los años.
+    """
+    almacen = LibroIncremental(directorio)
+    libro, estado = almacen.cargar()
+    if libro is None:
+        libro = df.iloc[0:0].copy()
+    # La marca de agua sale del propio libro, no de estado.json: si el
+    # estado falta o es de otra versión, las filas no se duplican
+    marca = max(_instantes(libro["UTC_Time"].tolist())) if len(libro) else None
+
+    # Filas de df que el libro aún no tiene
+    presentes = Counter(_claves(libro))
+    nuevas = []
+    for pos, clave in enumerate(_claves(df)):
+        if presentes[clave] > 0:
+            presentes[clave] -= 1
+            continue
+        nuevas.append(pos)
+    nuevo = df.iloc[nuevas].reset_index(drop=True)
+    if nuevo.empty:
+        print("Libro incremental: sin filas nuevas")
+    else:
+        print(f"Libro incremental: {len(nuevo)} filas nuevas")
+
+    # Primera fila afectada: la más antigua de las nuevas
+    desde = min(_instantes(nuevo["UTC_Time"].tolist())) if len(nuevo) else None
+    rebobinar = marca is not None and desde is not None and desde <= marca
+    if rebobinar:
+        print(f"Libro incremental: historia cambiada desde {desde}, se rebobina")
+
+    if len(nuevo):
+        prefetch_df_prices(nuevo)
+        convert_no_stables_in_df(nuevo)
+
+    # Libro sin tocar hasta la primera fila afectada, el resto por fecha
+    corte = sum(t <= desde for t in _instantes(libro["UTC_Time"].tolist())) if rebobinar else len(libro)
+    cola = pd.concat([libro.iloc[corte:], nuevo], ignore_index=True)
+    instantes = _instantes(cola["UTC_Time"].tolist())
+    cola = cola.iloc[sorted(range(len(cola)), key=instantes.__getitem__)]
+    combinado = pd.concat([libro.iloc[:corte], cola], ignore_index=True)
+    for columna in COLUMNAS_RESULTADO:
+        if columna not in combinado.columns:
+            combinado[columna] = None
+
+    fifo = CryptoFIFO()
+    if not rebobinar and "lotes" in estado and estado.get("checksum") == _checksum(libro):
+        # Solo se añaden filas al final: el FIFO sigue donde se quedó
+        restaurar_fifo(fifo, estado)
+        if len(nuevo):
+            tramo = combinado.iloc[len(libro):].copy()
+            if workers > 1:
+                procesar_df_con_fifo_paralelo(tramo, fifo, workers)
+            else:
+                procesar_df_con_fifo(tramo, fifo)
+            for columna in COLUMNAS_RESULTADO:
+                combinado[columna] = pd.Series(
+                    combinado[columna].iloc[:len(libro)].tolist() + tramo[columna].tolist(),
+                    index=combinado.index, dtype=object,
+                )
+    else:
+        # Las filas hasta el cierre usado recuperan sus resultados del cierre
+        inicio = procesar_df_con_fifo_por_anios(combinado, fifo, almacen.dir_cierres, workers)
+        if inicio < len(combinado):
+            desde = _instantes([combinado["UTC_Time"].iloc[inicio]])[0]
+
+    # Totales: se conservan los años anteriores a la primera fila afectada
+    totales = {(anio, moneda): datos for anio, moneda, datos in estado.get("totales", [])}
+    if desde is not None or not totales:
+        anio_desde = extraer_anio(desde) if desde is not None else 0
+        totales = {k: v for k, v in totales.items() if k[0] < anio_desde}
+        anios = [extraer_anio(t) for t in combinado["UTC_Time"]]
+        recalcular = combinado[[a >= anio_desde for a in anios]]
+        totales.update(calcular_totales_base_ahorro(recalcular))
+
+    almacen.guardar(combinado, fifo, totales)
+    return combinado, totales
@@ -0,0 +1,257 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+
+from cliente_http import get_client
+
+
+# Límites por host: (peso permitido, ventana en segundos).
+# Binance spot: 6000 de peso por minuto y por IP. El resto son
+# estimaciones conservadoras de los planes gratuitos.
+HOST_LIMITS: Dict[str, Tuple[int, float]] = {
+    "api.binance.com": (6000, 60.0),
+    "api.coingecko.com": (30, 60.0),
+    "api.frankfurter.app": (600, 60.0),
+}
+DEFAULT_LIMIT = (600, 60.0)
+
+WEIGHT_HEADER = "X-MBX-USED-WEIGHT-1m"
+
+
+def retry_after_seconds(value: Optional[str]) -> float:
+    """
+    Segundos de una cabecera Retry-After, en segundos o como fecha HTTP
+    (RFC 9110). 0 si falta o no se entiende: se usa el backoff normal.
+    """
+    if not value:
+        return 0.0
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        return 0.0
+
+
+class CircuitOpenError(requests.RequestException):
+    """El host está en cuarentena tras demasiados fallos seguidos."""
+
+
+class TokenBucket:
+    """
+    Cubo de fichas: se rellena a capacity/window fichas por segundo y cada
+    petición consume su peso. acquire() bloquea hasta que haya fichas.
+    """
+
+    def __init__(self, capacity: float, window: float, clock=time.monotonic, sleep=time.sleep):
+        self.capacity = capacity
+        self.rate = capacity / window
+        self.tokens = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, weight: float = 1):
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._refill(now)
+                if now >= self._paused_until and self.tokens >= weight:
+                    self.tokens -= weight
+                    return
+                wait = max(self._paused_until - now, (weight - self.tokens) / self.rate)
+            self._sleep(wait)
+
+    def sync_used(self, used: float):
+        """
+        Ajusta las fichas al peso que el servidor dice llevar consumido en
+        la ventana actual (incluye otros procesos que compartan IP).
+        """
+        with self._lock:
+            self._refill(self._clock())
+            self.tokens = min(self.tokens, self.capacity - used)
+
+    def pause(self, seconds: float):
+        """Detiene a todas las peticiones del host durante seconds."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, self._clock() + seconds)
+            self.tokens = min(self.tokens, 0)
+
+
+class CircuitBreaker:
+    """
+    Tras threshold fallos seguidos el host queda abierto cooldown segundos.
+    Pasado ese tiempo se deja pasar una petición de prueba (semiabierto):
+    si va bien se cierra, si falla se vuelve a abrir.
+    """
+
+    def __init__(self, threshold: int = 5, cooldown: float = 60.0, clock=time.monotonic):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def check(self, host: str):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if self._clock() - self.opened_at < self.cooldown:
+                raise CircuitOpenError(f"Circuito abierto para {host}")
+            # Semiabierto: una única petición de prueba
+            self.opened_at = self._clock()
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self, trip: bool = False):
+        with self._lock:
+            self.failures += 1
+            if trip or self.failures >= self.threshold:
+                self.opened_at = self._clock()
+
+
+class RateGovernor:
+    """
+    Regulador compartido de peticiones HTTP por host.
+
+    - Cubo de fichas por host, sincronizado con X-MBX-USED-WEIGHT-1m y
+      limitado a safety * límite para no rozar el baneo.
+    - 429/418 respetan Retry-After pausando a todo el host.
+    - Reintentos con backoff exponencial con jitter ante 429/418/5xx y
+      errores de conexión.
+    - Cortacircuitos por host: 418 (IP baneada) lo abre al momento.
+    """
+
+    def __init__(
+        self,
+        send: Optional[Callable] = None,
+        host_limits: Optional[Dict[str, Tuple[int, float]]] = None,
+        safety: float = 0.9,
+        max_retries: int = 5,
+        base_backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        breaker_threshold: int = 5,
+        breaker_cooldown: float = 60.0,
+        clock=time.monotonic,
+        sleep=time.sleep,
+    ):
+        self.send = send or requests.get
+        self.host_limits = dict(HOST_LIMITS, **(host_limits or {}))
+        self.safety = safety
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self._clock = clock
+        self._sleep = sleep
+
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.retries = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def _host_state(self, host: str) -> Tuple[TokenBucket, CircuitBreaker]:
+        with self._lock:
+            if host not in self.buckets:
+                limit, window = self.host_limits.get(host, DEFAULT_LIMIT)
+                self.buckets[host] = TokenBucket(limit * self.safety, window, self._clock, self._sleep)
+                self.breakers[host] = CircuitBreaker(self.breaker_threshold, self.breaker_cooldown, self._clock)
+            return self.buckets[host], self.breakers[host]
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter: uniforme entre 0 y el tope exponencial
+        return random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+
+    def get(self, url: str, weight: float = 1, **kwargs) -> requests.Response:
+        """
+        GET regulado. Devuelve la respuesta correcta o lanza la última
+        excepción (HTTPError, ConnectionError, CircuitOpenError).
+        """
+        host = urlparse(url).netloc
+        bucket, breaker = self._host_state(host)
+
+        for attempt in range(self.max_retries + 1):
+            breaker.check(host)
+            bucket.acquire(weight)
+
+            try:
+                response = self.send(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                breaker.record_failure()
+                if attempt == self.max_retries:
+                    raise
+                self.retries += 1
+                self._sleep(self._backoff(attempt))
+                continue
+
+            used = response.headers.get(WEIGHT_HEADER)
+            if used is not None:
+                bucket.sync_used(float(used))
+
+            if response.status_code in (418, 429):
+                self.throttled += 1
+                retry_after = retry_after_seconds(response.headers.get("Retry-After"))
+                bucket.pause(max(retry_after, self._backoff(attempt)))
+                breaker.record_failure(trip=response.status_code == 418)
+            elif response.status_code >= 500:
+                breaker.record_failure()
+                self._sleep(self._backoff(attempt))
+            else:
+                breaker.record_success()
+                response.raise_for_status()
+                return response
+
+            if attempt == self.max_retries:
+                response.raise_for_status()
+            self.retries += 1
+
+        raise requests.HTTPError(f"Reintentos agotados para {url}")
+
+    def stats(self) -> dict:
+        return {
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "open_circuits": sorted(h for h, b in self.breakers.items() if b.opened_at is not None),
+        }
+
+
+_governor: Optional[RateGovernor] = None
+_governor_lock = threading.Lock()
+
+
+def get_governor() -> RateGovernor:
+    """
+    Regulador único del proceso, compartido por todos los hilos.
+    Envía a través de las sesiones persistentes de cliente_http.
+    """
+    global _governor
+    with _governor_lock:
+        if _governor is None:
+            _governor = RateGovernor(send=get_client().get)
+        return _governor
+
+
+def set_governor(governor: RateGovernor):
+    """Sustituye el regulador del proceso (p. ej. con límites de prueba)."""
+    global _governor
+    with _governor_lock:
+        _governor = governor
@@ -0,0 +1,234 @@
+"""
+Coste de adquisición por varios métodos en una sola pasada.
+
+Recorre el libro normalizado una vez y lleva a la vez los libros FIFO,
+LIFO, HIFO (primero el lote de mayor precio unitario) y MEDIO (coste
+medio ponderado). Los lotes de cada cripto se guardan una sola vez; cada
+método solo guarda el orden en que los consume y el resto de los lotes
+que ha empezado a consumir. FIFO da exactamente lo mismo que CryptoFIFO.
+"""
+import abc
+import heapq
+import os
+from fractions import Fraction
+
+import pandas as pd
+
+from modulo_procesos_calculos import TIPOS_ENTRADA, columnas_fifo
+from pila_fifo import TOL, DetalleFIFO, Lote, Salida
+from punto_fijo import amount_decimal, div_round
+
+METODOS = ("FIFO", "LIFO", "HIFO", "MEDIO")
+
+# Métodos a comparar en el parseador, vacío = ninguno
+COST_METHODS = tuple(m.strip().upper() for m in os.environ.get("ARLES_COST_METHODS", "").split(",") if m.strip())
+
+
+class _LibroLotes(abc.ABC):
+    """Libro que consume lotes enteros o en parte en algún orden."""
+
+    def __init__(self, lotes: list):
+        self.lotes = lotes          # compartidos entre métodos, no se modifican
+        self.restos = {}            # idx -> (cantidad, coste) de lotes empezados
+
+    @abc.abstractmethod
+    def _siguiente(self):
+        """Índice del próximo lote a consumir, o None si no quedan."""
+
+    @abc.abstractmethod
+    def _quitar(self):
+        """Saca del orden el lote devuelto por _siguiente, ya agotado."""
+
+    @abc.abstractmethod
+    def add(self, idx: int):
+        """Añade al orden el lote idx de lotes."""
+
+    def consume(self, cripto: str, cantidad: int) -> tuple:
+        coste_total = 0
+        restante = cantidad
+        salidas = []
+        while restante > 0:
+            idx = self._siguiente()
+            if idx is None:
+                break
+            lote = self.lotes[idx]
+            lote_cantidad, lote_coste = self.restos.get(idx, (lote.cantidad, lote.coste))
+            if lote_cantidad <= restante:
+                salidas.append(Salida(cripto, lote.fecha, lote_cantidad, lote_coste, lote_cantidad, lote_coste))
+                coste_total += lote_coste
+                restante -= lote_cantidad
+                self.restos.pop(idx, None)
+                self._quitar()
+            else:
+                coste = div_round(lote_coste * restante, lote_cantidad)
+                salidas.append(Salida(cripto, lote.fecha, restante, coste, lote_cantidad, lote_coste))
+                coste_total += coste
+                self.restos[idx] = (lote_cantidad - restante, lote_coste - coste)
+                restante = 0
+        return coste_total, salidas, restante
+
+
+class _LibroFIFO(_LibroLotes):
+    def __init__(self, lotes: list):
+        super().__init__(lotes)
+        self.cabeza = 0
+
+    def add(self, idx: int):
+        pass                        # los lotes ya están en orden de entrada
+
+    def _siguiente(self):
+        return self.cabeza if self.cabeza < len(self.lotes) else None
+
+    def _quitar(self):
+        self.cabeza += 1
+
+
+class _LibroLIFO(_LibroLotes):
+    def __init__(self, lotes: list):
+        super().__init__(lotes)
+        self.pila = []
+
+    def add(self, idx: int):
+        self.pila.append(idx)
+
+    def _siguiente(self):
+        return self.pila[-1] if self.pila else None
+
+    def _quitar(self):
+        self.pila.pop()
+
+
+class _LibroHIFO(_LibroLotes):
+    def __init__(self, lotes: list):
+        super().__init__(lotes)
+        self.monton = []            # (-precio unitario, idx): a igual precio, el más antiguo
+
+    def add(self, idx: int):
+        lote = self.lotes[idx]
+        precio = Fraction(lote.coste, lote.cantidad) if lote.cantidad else Fraction(0)
+        heapq.heappush(self.monton, (-precio, idx))
+
+    def _siguiente(self):
+        return self.monton[0][1] if self.monton else None
+
+    def _quitar(self):
+        heapq.heappop(self.monton)
+
+
+class _LibroMedio:
+    """Coste medio ponderado: un único saldo de cantidad y coste por cripto."""
+
+    def __init__(self, lotes: list):
+        self.lotes = lotes
+        self.cantidad = 0
+        self.coste = 0
+
+    def add(self, idx: int):
+        self.cantidad += self.lotes[idx].cantidad
+        self.coste += self.lotes[idx].coste
+
+    def consume(self, cripto: str, cantidad: int) -> tuple:
+        if self.cantidad == 0:
+            return 0, [], cantidad
+        tomada = min(cantidad, self.cantidad)
+        coste = self.coste if tomada == self.cantidad else div_round(self.coste * tomada, self.cantidad)
+        salida = Salida(cripto, None, tomada, coste, self.cantidad, self.coste)
+        self.cantidad -= tomada
+        self.coste -= coste
+        return coste, [salida], cantidad - tomada
+
+
+_LIBROS = {"FIFO": _LibroFIFO, "LIFO": _LibroLIFO, "HIFO": _LibroHIFO, "MEDIO": _LibroMedio}
+
+
+class LibrosCoste:
+    """
+    Libros de coste de varios métodos sobre los mismos lotes. add y
+    consume tienen la misma forma que en CryptoFIFO; consume devuelve
+    {método: (coste_total, salidas)} con salidas como lista de Salida.
+    """
+
+    def __init__(self, metodos=METODOS):
+        desconocidos = [m for m in metodos if m not in _LIBROS]
+        if desconocidos:
+            raise ValueError(f"Métodos de coste desconocidos: {', '.join(desconocidos)} (válidos: {', '.join(METODOS)})")
+        self.metodos = tuple(metodos)
+        self.lotes = {}             # cripto -> [Lote] en orden de entrada
+        self.libros = {}            # cripto -> {método: libro}
+
+    def add(self, fecha: str, cripto: str, cantidad: int, coste: int):
+        cripto = cripto.upper()
+        if cripto not in self.lotes:
+            self.lotes[cripto] = []
+            self.libros[cripto] = {m: _LIBROS[m](self.lotes[cripto]) for m in self.metodos}
+        self.lotes[cripto].append(Lote(fecha, cantidad, coste))
+        idx = len(self.lotes[cripto]) - 1
+        for libro in self.libros[cripto].values():
+            libro.add(idx)
+
+    def consume(self, cripto: str, cantidad: int) -> dict:
+        cripto = cripto.upper()
+        if cripto not in self.libros:
+            raise ValueError(f"No hay registros para {cripto}")
+
+        resultados = {}
+        for metodo, libro in self.libros[cripto].items():
+            coste_total, salidas, restante = libro.consume(cripto, cantidad)
+            # La cantidad disponible es la misma en todos los métodos
+            if restante > TOL:
+                raise ValueError(
+                    f"No hay suficiente {cripto} para consumir {amount_decimal(cantidad)} "
+                    f"restante a {amount_decimal(restante)}"
+                )
+            resultados[metodo] = (coste_total, salidas)
+        return resultados
+
+
+def procesar_df_metodos(df, metodos=METODOS, detalle: bool = False):
+    """
+    Recorre el DataFrame normalizado una sola vez, con las mismas reglas
+    que procesar_df_con_fifo, y añade por cada método:
+        - Valor Adquisicion <método>   (EUR en punto fijo)
+        - Detalle <método>             (solo con detalle=True, DetalleFIFO)
+    El valor de transmisión no depende del método: es la columna
+    Valor Transmision de procesar_df_con_fifo, que aquí no se toca.
+    """
+    libros = LibrosCoste(metodos)
+    n = len(df)
+    adquisicion = {m: [0] * n for m in libros.metodos}
+    detalles = {m: [""] * n for m in libros.metodos}
+
+    columnas = columnas_fifo(df)
+    for pos in range(n):
+        if columnas["Declarable"][pos] != "S":
+            continue
+        tipo = columnas["Tipo"][pos]
+        fecha = columnas["UTC_Time"][pos]
+        recibido_cantidad = columnas["Recibido_Cantidad"][pos]
+        recibido_valor = columnas["Recibido_Valor_EUR"][pos]
+
+        if tipo in TIPOS_ENTRADA:
+            if recibido_cantidad > 0:
+                libros.add(fecha, columnas["Recibido_Moneda"][pos], abs(recibido_cantidad), abs(recibido_valor))
+                for metodo in libros.metodos:
+                    adquisicion[metodo][pos] = recibido_valor
+
+        elif tipo in ("VENTA", "PERMUTA"):
+            emitido_cantidad = columnas["Emitido_Cantidad"][pos]
+            salidas = libros.consume(columnas["Emitido_Moneda"][pos], abs(emitido_cantidad))
+            for metodo, (coste_total, registros) in salidas.items():
+                adquisicion[metodo][pos] = coste_total
+                if detalle:
+                    detalles[metodo][pos] = DetalleFIFO(registros)
+
+            if tipo == "PERMUTA":
+                # El lote recibido cuesta el valor de transmisión, como en el FIFO
+                emitido_valor = columnas["Emitido_Valor_EUR"][pos]
+                valor_transmision = max(emitido_valor, recibido_valor)
+                libros.add(fecha, columnas["Recibido_Moneda"][pos], abs(recibido_cantidad), abs(valor_transmision))
+
+    for metodo in libros.metodos:
+        df[f"Valor Adquisicion {metodo}"] = pd.Series(adquisicion[metodo], index=df.index, dtype=object)
+        if detalle:
+            df[f"Detalle {metodo}"] = detalles[metodo]
+    return df
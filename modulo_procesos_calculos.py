@@ -1,139 +1,284 @@
-from decimal import Decimal
-from pila_fifo import CryptoFIFO
-from decimal import Decimal, InvalidOperation
-import math
+from numbers import Integral
+from pila_fifo import CryptoFIFO, DetalleFIFO, Entrada, Lote
+import logging
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
-def safe_decimal(value):
+import pandas as pd
+
+from punto_fijo import amount_decimal, eur_decimal, to_amount, to_eur
+
+logger = logging.getLogger(__name__)
+
+# Procesos para procesar_df_con_fifo_paralelo, 1 = FIFO secuencial
+FIFO_WORKERS = int(os.environ.get("ARLES_FIFO_WORKERS", "1"))
+
+TIPOS_ENTRADA = ("COMPRA", "REWARDS", "STAKING", "AIRDROP")
+
+
+def safe_units(value, to_fixed=to_amount) -> int:
     """
-    Convierte cualquier valor a Decimal de forma segura.
-    Si es None, NaN, vacío o inválido → devuelve Decimal("0").
+    Valor en punto fijo de una celda: los enteros ya lo están; el resto se
+    convierte con to_fixed (to_amount o to_eur). Ausente o inválido -> 0.
     """
-    if value is None:
-        return Decimal("0")
+    if isinstance(value, Integral):
+        return int(value)
+    units = to_fixed(value)
+    return 0 if units is None else units
 
-    # pandas NaN
-    if isinstance(value, float) and math.isnan(value):
-        return Decimal("0")
 
-    # cadenas vacías o basura
-    value_str = str(value).strip()
-    if value_str == "" or value_str.lower() in ("nan", "none"):
-        return Decimal("0")
-
-    try:
-        return Decimal(value_str)
-    except InvalidOperation:
-        return Decimal("0")
+def columnas_fifo(df) -> dict:
+    """
+    Columnas que usa el FIFO como listas, leídas una sola vez, con las
+    cantidades y valores ya en punto fijo (safe_units por celda). También
+    las usa metodos_coste, para seguir las mismas reglas.
+    """
+    columnas = {c: df[c].tolist() for c in (
+        "Declarable", "Tipo", "UTC_Time", "Emitido_Moneda", "Recibido_Moneda",
+    )}
+    for c in ("Emitido_Cantidad", "Recibido_Cantidad"):
+        columnas[c] = [safe_units(v) for v in df[c].tolist()]
+    for c in ("Emitido_Valor_EUR", "Recibido_Valor_EUR"):
+        columnas[c] = [safe_units(v, to_eur) for v in df[c].tolist()]
+    return columnas
 
 
 def procesar_df_con_fifo(df, fifo: CryptoFIFO):
     """
     Recorre el DataFrame normalizado y aplica FIFO usando la clase CryptoFIFO.
     Añade columnas:
-        - Valor Adquisicion
-        - Valor Transmision
-        - Detalle FIFO
+        - Valor Adquisicion   (EUR en punto fijo, unidades de 1e-10)
+        - Valor Transmision   (ídem)
+        - Detalle FIFO        (DetalleFIFO; el texto sale con str() al exportar)
     Solo procesa filas con Declarable == "S".
+
+    Las columnas se leen una vez y los resultados se escriben de golpe al
+    final; las trazas de cada salida van a logging (nivel DEBUG).
     """
+    n = len(df)
+    columnas = columnas_fifo(df)
+    adquisicion = [0] * n
+    transmision = [0] * n
+    detalles = [""] * n
+
+    try:
+        # Recorrer filas en orden cronológico
+        for pos in range(n):
 
-    # Crear columnas nuevas
-    df["Valor Adquisicion"] = Decimal("0")
-    df["Valor Transmision"] = Decimal("0")
-    df["Detalle FIFO"] = ""
+            if columnas["Declarable"][pos] != "S":
+                continue
 
-    # Recorrer filas en orden cronológico
-    for idx, row in df.iterrows():
+            tipo = columnas["Tipo"][pos]
+            fecha = columnas["UTC_Time"][pos]
 
-        if row["Declarable"] != "S":
-            continue
+            emitido_moneda = columnas["Emitido_Moneda"][pos]
+            emitido_cantidad = columnas["Emitido_Cantidad"][pos]
+            emitido_valor = columnas["Emitido_Valor_EUR"][pos]
 
-        tipo = row["Tipo"]
-        fecha = row["UTC_Time"]
+            recibido_moneda = columnas["Recibido_Moneda"][pos]
+            recibido_cantidad = columnas["Recibido_Cantidad"][pos]
+            recibido_valor = columnas["Recibido_Valor_EUR"][pos]
 
-        emitido_moneda = row["Emitido_Moneda"]
-        emitido_cantidad = safe_decimal(row["Emitido_Cantidad"])
-        emitido_valor = safe_decimal(row["Emitido_Valor_EUR"])
+            # ----------------------------------------------------
+            # ✅ COMPRA
+            # ----------------------------------------------------
+            if tipo in TIPOS_ENTRADA:
 
-        recibido_moneda = row["Recibido_Moneda"]
-        recibido_cantidad = safe_decimal(row["Recibido_Cantidad"])
-        recibido_valor = safe_decimal(row["Recibido_Valor_EUR"])
+                if recibido_cantidad > 0:
+                    detalle_entrada = Entrada(recibido_moneda, recibido_cantidad, recibido_valor)
+                    fifo.add(
+                        fecha=fecha,
+                        cripto=recibido_moneda,
+                        cantidad=abs(recibido_cantidad),
+                        coste=abs(recibido_valor)
+                    )
+                    adquisicion[pos] = recibido_valor
+                    detalles[pos] = DetalleFIFO(entrada=detalle_entrada)
 
-        # ----------------------------------------------------
-        # ✅ COMPRA
-        # ----------------------------------------------------
-        if tipo in ["COMPRA","REWARDS","STAKING","AIRDROP"]:
+            # ----------------------------------------------------
+            # ✅ VENTA
+            # ----------------------------------------------------
+            elif tipo == "VENTA":
 
-            if recibido_cantidad > 0:
-                precio_unitario = recibido_valor / recibido_cantidad
+                coste_total, detalle = fifo.consume(
+                    cripto=emitido_moneda,
+                    cantidad=abs(emitido_cantidad),
+                    registros=True,
+                )
+                logger.debug("Imprimo debug %s", detalle)
+
+                adquisicion[pos] = coste_total
+                transmision[pos] = recibido_valor
+                detalles[pos] = DetalleFIFO(detalle)
+
+            # ----------------------------------------------------
+            # ✅ PERMUTA
+            # ----------------------------------------------------
+            elif tipo == "PERMUTA":
+
+                # 1) Consumir el activo emitido
+                coste_total, detalle_salida = fifo.consume(
+                    cripto=emitido_moneda,
+                    cantidad=abs(emitido_cantidad),
+                    registros=True,
+                )
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(
+                        "Debug del coste en permuta %s  y %s= %s",
+                        emitido_moneda, amount_decimal(emitido_cantidad), eur_decimal(coste_total),
+                    )
+
+                # 2) Valor de transmisión = mayor de los dos valores
+                valor_transmision = max(emitido_valor, recibido_valor)
+                adquisicion[pos] = coste_total
+                transmision[pos] = valor_transmision
+
+                # 3) Detalle del lote que entra (precio unitario = valor de transmisión / cantidad)
+                detalle_entrada = Entrada(recibido_moneda, recibido_cantidad, valor_transmision)
+
+                # 4) Insertar lote del activo recibido (coste = valor de transmisión)
                 fifo.add(
                     fecha=fecha,
                     cripto=recibido_moneda,
                     cantidad=abs(recibido_cantidad),
-                    precio_unitario=abs(precio_unitario)
+                    coste=abs(valor_transmision)
                 )
 
-                df.at[idx, "Valor Adquisicion"] = recibido_valor
-                df.at[idx, "Valor Transmision"] = Decimal("0")
-                df.at[idx, "Detalle FIFO"] = (
-                    f"Entrada lote: {recibido_cantidad} {recibido_moneda} "
-                    f"a {precio_unitario} EUR/u"
-                )
+                # 5) Registrar detalle FIFO completo (salida + entrada)
+                detalles[pos] = DetalleFIFO(detalle_salida, detalle_entrada)
+    finally:
+        # También si una fila falla: las anteriores quedan escritas, como con df.at
+        df["Valor Adquisicion"] = pd.Series(adquisicion, index=df.index, dtype=object)
+        df["Valor Transmision"] = pd.Series(transmision, index=df.index, dtype=object)
+        df["Detalle FIFO"] = detalles
 
-        # ----------------------------------------------------
-        # ✅ VENTA
-        # ----------------------------------------------------
-        elif tipo == "VENTA":
+    return df
 
-            coste_total, detalle = fifo.consume(
-                cripto=emitido_moneda,
-                cantidad=abs(emitido_cantidad)
-            )
-            print("Imprimo debug " + str(detalle))
 
-            df.at[idx, "Valor Adquisicion"] = coste_total
-            df.at[idx, "Valor Transmision"] = recibido_valor
-            df.at[idx, "Detalle FIFO"] = str(detalle)
+def _fifo_de_cripto(cripto: str, lotes, operaciones) -> tuple:
+    """
+    Cola FIFO de una sola cripto, en un proceso aparte. operaciones son
+    (pos, "add", fecha, cantidad, coste) o (pos, "consume", cantidad) en
+    orden cronológico; lotes es la cola de partida (None si la cripto no
+    tenía registros). Devuelve la cola final, {pos: (coste_total, [Salida])}
+    de cada salida y el primer error como (pos, mensaje), o None.
+    """
+    fifo = CryptoFIFO()
+    if lotes is not None:
+        fifo.lotes[cripto] = _copia_lotes(lotes)
+    try:
+        costes = fifo.consume_batch(cripto, [op[1:] for op in operaciones], registros=True)
+    except ValueError:
+        return None, {}, _primer_error(cripto, lotes, operaciones)
+    salidas = dict(zip((op[0] for op in operaciones if op[1] == "consume"), costes))
+    cola = fifo.lotes.get(cripto)
+    return (None if cola is None else list(cola)), salidas, None
 
-        # ----------------------------------------------------
-        # ✅ PERMUTA
-        # ----------------------------------------------------
-        elif tipo == "PERMUTA":
 
-            # 1) Consumir el activo emitido
-            coste_total, detalle_salida = fifo.consume(
-                cripto=emitido_moneda,
-                cantidad=abs(emitido_cantidad)
-            )
+def _copia_lotes(lotes) -> deque:
+    """
+    Copia de la cola de partida: consume_batch y consume modifican el lote
+    de cabeza, y en el camino sin procesos los lotes son los del llamante,
+    que no debe cambiar si alguna cripto falla.
+    """
+    return deque(Lote(l.fecha, l.cantidad, l.coste) for l in lotes)
 
-            print(f"Debug del coste en permuta {emitido_moneda}  y {emitido_cantidad}= " +  str(coste_total))
 
-            # 2) Valor de transmisión = mayor de los dos valores
-            valor_transmision = max(emitido_valor, recibido_valor)
+def _primer_error(cripto: str, lotes, operaciones) -> tuple:
+    """
+    consume_batch no dice qué operación ha fallado: se repiten una a una
+    desde la cola de partida y se devuelve (pos, mensaje) del error.
+    """
+    fifo = CryptoFIFO()
+    if lotes is not None:
+        fifo.lotes[cripto] = _copia_lotes(lotes)
+    for op in operaciones:
+        try:
+            if op[1] == "add":
+                fifo.add(op[2], cripto, op[3], op[4])
+            else:
+                fifo.consume(cripto, op[2])
+        except ValueError as e:
+            return op[0], str(e)
+    return None
 
-            df.at[idx, "Valor Adquisicion"] = coste_total
-            df.at[idx, "Valor Transmision"] = valor_transmision
 
-            # 3) Determinar precio unitario del lote que entra
-            precio_unitario = valor_transmision / recibido_cantidad
+def procesar_df_con_fifo_paralelo(df, fifo: CryptoFIFO, workers: int = None):
+    """
+    Mismo resultado que procesar_df_con_fifo, con las colas de cada cripto
+    en un pool de procesos. El coste de un lote nuevo sale siempre del
+    valor de mercado (Recibido_Valor_EUR o el mayor de los dos valores en
+    una PERMUTA), nunca de una salida FIFO, así que la cola de cada cripto
+    no depende de las demás: las filas declarables se reparten por cripto,
+    cada cola se procesa en orden y los resultados vuelven a su fila.
+
+    Si alguna cola falla se lanza el error de la fila más temprana, como
+    en la versión secuencial, sin escribir resultados.
+    """
+    workers = workers or os.cpu_count()
+    n = len(df)
+    adquisicion = [0] * n
+    transmision = [0] * n
+    detalles = [""] * n
+    permutas = {}                # pos -> Entrada del lote recibido
+
+    columnas = columnas_fifo(df)
+    operaciones = {}
+    for pos in range(n):
+        if columnas["Declarable"][pos] != "S":
+            continue
+        tipo = columnas["Tipo"][pos]
+        fecha = columnas["UTC_Time"][pos]
+        emitido_moneda = columnas["Emitido_Moneda"][pos]
+        recibido_moneda = columnas["Recibido_Moneda"][pos]
+        emitido_cantidad = columnas["Emitido_Cantidad"][pos]
+        recibido_cantidad = columnas["Recibido_Cantidad"][pos]
+        emitido_valor = columnas["Emitido_Valor_EUR"][pos]
+        recibido_valor = columnas["Recibido_Valor_EUR"][pos]
+
+        if tipo in TIPOS_ENTRADA:
+            if recibido_cantidad > 0:
+                operaciones.setdefault(recibido_moneda.upper(), []).append(
+                    (pos, "add", fecha, abs(recibido_cantidad), abs(recibido_valor))
+                )
+                adquisicion[pos] = recibido_valor
+                detalles[pos] = DetalleFIFO(entrada=Entrada(recibido_moneda, recibido_cantidad, recibido_valor))
+
+        elif tipo == "VENTA":
+            operaciones.setdefault(emitido_moneda.upper(), []).append((pos, "consume", abs(emitido_cantidad)))
+            transmision[pos] = recibido_valor
 
-            # 4) Insertar lote del activo recibido
-            fifo.add(
-                fecha=fecha,
-                cripto=recibido_moneda,
-                cantidad=abs(recibido_cantidad),
-                precio_unitario=abs(precio_unitario)
+        elif tipo == "PERMUTA":
+            valor_transmision = max(emitido_valor, recibido_valor)
+            operaciones.setdefault(emitido_moneda.upper(), []).append((pos, "consume", abs(emitido_cantidad)))
+            operaciones.setdefault(recibido_moneda.upper(), []).append(
+                (pos, "add", fecha, abs(recibido_cantidad), abs(valor_transmision))
             )
+            transmision[pos] = valor_transmision
+            permutas[pos] = Entrada(recibido_moneda, recibido_cantidad, valor_transmision)
 
-            # 5) Registrar detalle FIFO completo (salida + entrada)
-            detalle_entrada = {
-                 f"Entrada lote: {recibido_cantidad} {recibido_moneda} "
-                f"a {precio_unitario} EUR/u"
-            }
+    # Las criptos con más operaciones primero, para repartir mejor la carga
+    criptos = sorted(operaciones, key=lambda c: len(operaciones[c]), reverse=True)
+    args = [(c, list(fifo.lotes[c]) if c in fifo.lotes else None, operaciones[c]) for c in criptos]
+    if workers > 1 and len(criptos) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(criptos))) as pool:
+            resultados = list(pool.map(_fifo_de_cripto, *zip(*args)))
+    else:
+        resultados = [_fifo_de_cripto(*a) for a in args]
 
-            df.at[idx, "Detalle FIFO"] = str({
-                "salida": detalle_salida,
-                "entrada": detalle_entrada
-            })
+    errores = [error for _, _, error in resultados if error is not None]
+    if errores:
+        raise ValueError(min(errores)[1])
 
+    for cripto, (lotes, salidas, _) in zip(criptos, resultados):
+        if lotes is not None:
+            fifo.lotes[cripto] = deque(lotes)
+        for pos, (coste_total, detalle) in salidas.items():
+            adquisicion[pos] = coste_total
+            detalles[pos] = DetalleFIFO(detalle, permutas.get(pos))
 
-    return df
\ No newline at end of file
+    df["Valor Adquisicion"] = pd.Series(adquisicion, index=df.index, dtype=object)
+    df["Valor Transmision"] = pd.Series(transmision, index=df.index, dtype=object)
+    df["Detalle FIFO"] = detalles
+    return df
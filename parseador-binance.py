@@ -1,15 +1,27 @@
 # parseador_binance_excel.py
 import csv
+import logging
+import os
 import pandas as pd
 from dataclasses import dataclass
 from typing import List, Optional
 from collections import defaultdict
 from decimal import Decimal, InvalidOperation, getcontext
 from datetime import datetime, timezone
-from bce_api import convert_stables_in_df, translate_eur_values, convert_no_stables_in_df
+from bce_api import (
+    convert_stables_in_df, translate_eur_values, convert_no_stables_in_df,
+    get_price_cache, prefetch_df_prices, get_provider_chain,
+)
+from cliente_http import get_client
 from pila_fifo import CryptoFIFO
-from modulo_procesos_calculos import procesar_df_con_fifo
-from generador_informes import generar_informe_fiscal_base_ahorro_txt
+from modulo_procesos_calculos import FIFO_WORKERS, procesar_df_con_fifo, procesar_df_con_fifo_paralelo
+from generador_informes import (
+    generar_comparativa_metodos_txt, generar_informe_fiscal_base_ahorro_txt, generar_informe_txt_base_ahorro,
+)
+from metodos_coste import COST_METHODS, procesar_df_metodos
+from cierres_fifo import FIFO_CHECKPOINTS, procesar_df_con_fifo_por_anios
+from libro_incremental import LEDGER_DIR, actualizar_libro
+from punto_fijo import amount_decimal, frame_to_decimal, to_amount, to_eur
 
 
 
@@ -49,9 +61,12 @@ def remove_negative_signs(df):
 
     for col in cols:
         if col in df.columns:
-            df[col] = df[col].apply(
-                lambda x: str(x).lstrip("-") if isinstance(x, str) else x
-            )
+            # dtype object: con None de por medio pandas pasaría a float64
+            # y sin None a int64; el punto fijo necesita enteros de Python
+            df[col] = pd.Series([
+                abs(x) if isinstance(x, int) else (str(x).lstrip("-") if isinstance(x, str) else x)
+                for x in df[col]
+            ], index=df.index, dtype=object)
 
     return df
 
@@ -73,16 +88,27 @@ class NormalizedRow:
     tracker: str                # siempre "binance"
     tipo: str                   # COMPRA / VENTA / PERMUTA / INTERNAL / DEPOSIT / WITHDRAW
     emitido_moneda: str
-    emitido_cantidad: Decimal
-    emitido_valor_eur: str      # vacío
+    emitido_cantidad: Optional[int]      # unidades de 1e-8 (punto_fijo)
+    emitido_valor_eur: Optional[int]     # unidades de 1e-10 EUR, None si vacío
     recibido_moneda: str
-    recibido_cantidad: Decimal
-    recibido_valor_eur: str     # vacío
+    recibido_cantidad: Optional[int]
+    recibido_valor_eur: Optional[int]
     comision_moneda: Optional[str]
-    comision_cantidad: Optional[Decimal]
-    comision_valor_eur: str     # vacío
+    comision_cantidad: Optional[int]
+    comision_valor_eur: Optional[int]
     declarable: str             # "Sí" / "No"
 
+    def __post_init__(self):
+        # Los parsers pasan Decimal o texto: se pasa a punto fijo una sola vez
+        for name in ("emitido_cantidad", "recibido_cantidad", "comision_cantidad"):
+            value = getattr(self, name)
+            if not isinstance(value, int):
+                setattr(self, name, to_amount(value))
+        for name in ("emitido_valor_eur", "recibido_valor_eur", "comision_valor_eur"):
+            value = getattr(self, name)
+            if not isinstance(value, int):
+                setattr(self, name, to_eur(value))
+
 def classify_tipo(emitido_moneda: str, recibido_moneda: str, tipo_defecto: str) -> str:
     emit_fiat = emitido_moneda in FIAT_CURRENCIES
     rec_fiat = recibido_moneda in FIAT_CURRENCIES
@@ -207,62 +233,63 @@ def parse_group(ts: str, rows: List[RawRow]) -> List[NormalizedRow]:
             ))    
     return normalized
 
-def check_integrity(raw_rows, normalized_rows, tolerance=Decimal("1e-8")):
-    sums_original = defaultdict(Decimal)
+def check_integrity(raw_rows, normalized_rows, tolerance=1):
+    """Sumas por moneda en punto fijo; tolerance en unidades de 1e-8."""
+    sums_original = defaultdict(int)
     for r in raw_rows:
-        sums_original[r.coin] += r.change
+        sums_original[r.coin] += to_amount(r.change)
 
-    sums_normalized = defaultdict(Decimal)
+    sums_normalized = defaultdict(int)
     for n in normalized_rows:
         if n.emitido_moneda:
-            sums_normalized[n.emitido_moneda] += n.emitido_cantidad
+            sums_normalized[n.emitido_moneda] += n.emitido_cantidad or 0
         if n.recibido_moneda:
-            sums_normalized[n.recibido_moneda] += n.recibido_cantidad
+            sums_normalized[n.recibido_moneda] += n.recibido_cantidad or 0
         if n.comision_moneda:
-            sums_normalized[n.comision_moneda] += n.comision_cantidad
+            sums_normalized[n.comision_moneda] += n.comision_cantidad or 0
 
     print("\nPrueba de integridad:")
     for coin in sorted(set(sums_original.keys()) | set(sums_normalized.keys())):
-        orig = sums_original[coin]
-        norm = sums_normalized[coin]
-        if abs(orig - norm) <= tolerance:
+        orig = amount_decimal(sums_original[coin])
+        norm = amount_decimal(sums_normalized[coin])
+        if abs(sums_original[coin] - sums_normalized[coin]) <= tolerance:
             print(f"{coin} → OK (original {orig}, normalizado {norm})")
         else:
             print(f"{coin} → ERROR (original {orig}, normalizado {norm})")	
 
 def check_coin_amounts_absolute(df):
-    totals_emitido = defaultdict(Decimal)
-    totals_recibido = defaultdict(Decimal)
-    totals_comision = defaultdict(Decimal)
+    totals_emitido = defaultdict(int)
+    totals_recibido = defaultdict(int)
+    totals_comision = defaultdict(int)
 
     for _, row in df.iterrows():
         if row["Emitido_Moneda"]:
-            totals_emitido[row["Emitido_Moneda"]] += abs(Decimal(row["Emitido_Cantidad"]))
+            totals_emitido[row["Emitido_Moneda"]] += abs(row["Emitido_Cantidad"] or 0)
         if row["Recibido_Moneda"]:
-            totals_recibido[row["Recibido_Moneda"]] += abs(Decimal(row["Recibido_Cantidad"]))
+            totals_recibido[row["Recibido_Moneda"]] += abs(row["Recibido_Cantidad"] or 0)
         if row["Comision_Moneda"]:
-            totals_comision[row["Comision_Moneda"]] += abs(Decimal(row["Comision_Cantidad"]))
+            totals_comision[row["Comision_Moneda"]] += abs(row["Comision_Cantidad"] or 0)
 
     print("\nTotales emitido (valores absolutos):")
     for coin in sorted(totals_emitido.keys()):
-        print(f"{coin}: {totals_emitido[coin]}")
+        print(f"{coin}: {amount_decimal(totals_emitido[coin])}")
 
     print("\nTotales recibido (valores absolutos):")
     for coin in sorted(totals_recibido.keys()):
-        print(f"{coin}: {totals_recibido[coin]}")
+        print(f"{coin}: {amount_decimal(totals_recibido[coin])}")
 
     print("\nTotales comisión (valores absolutos):")
     for coin in sorted(totals_comision.keys()):
-        print(f"{coin}: {totals_comision[coin]}")
+        print(f"{coin}: {amount_decimal(totals_comision[coin])}")
 
 
     print("\nPrueba de integridad de cantidades (valores absolutos):")
     for coin in set(list(totals_emitido.keys()) + list(totals_recibido.keys()) + list(totals_comision.keys())):
-        emit = totals_emitido[coin]
-        rec = totals_recibido[coin]
-        fee = totals_comision[coin]
+        emit = amount_decimal(totals_emitido[coin])
+        rec = amount_decimal(totals_recibido[coin])
+        fee = amount_decimal(totals_comision[coin])
         balance = rec - (emit + fee)
-        if abs(balance) < Decimal("1e-8"):
+        if totals_recibido[coin] == totals_emitido[coin] + totals_comision[coin]:
             print(f"{coin} → OK (emitido {emit}, recibido {rec}, comisión {fee})")
         else:
             print(f"{coin} → DESCUADRE (emitido {emit}, recibido {rec}, comisión {fee}, balance {balance})")
@@ -395,16 +422,11 @@ def parse_coinbase_csv(input_path: str) -> List[NormalizedRow]:
     return normalized
 
 
-def main():
-    getcontext().prec = 18
-    import sys
-    if len(sys.argv) < 4:
-        print("Uso: python parseador_binance_excel.py binance.csv coinbase.csv output.xlsx")
-        sys.exit(1)
-
-    binance_input = sys.argv[1]
-    coinbase_input = sys.argv[2]
-    output_path = sys.argv[3]
+def load_normalized_rows(binance_input: str, coinbase_input: str):
+    """
+    Lee los CSV de Binance y Coinbase y devuelve (filas Binance en bruto,
+    operaciones normalizadas ordenadas por UTC_Time).
+    """
 
     # Procesar BINANCE   
 
@@ -439,41 +461,102 @@ def main():
 
     # Ordenar por UTC_Time
     normalized.sort(key=lambda r: parse_utc(r.utc_time))
-    
 
-    # Convertir a DataFrame y exportar a Excel
+    return raw_rows, normalized
+
+
+def build_dataframe(normalized: List[NormalizedRow]) -> pd.DataFrame:
+    """
+    DataFrame normalizado listo para valorar: signos quitados y las
+    columnas *_Valor_EUR de las patas en EUR ya rellenas. Cantidades y
+    valores van en punto fijo (enteros de Python en columnas object).
+    """
     df = pd.DataFrame([{
         "UTC_Time": r.utc_time,
         "Tracker": r.tracker,
         "Tipo": r.tipo,
         "Emitido_Moneda": r.emitido_moneda,
-        "Emitido_Cantidad": str(r.emitido_cantidad),
+        "Emitido_Cantidad": r.emitido_cantidad,
         "Emitido_Valor_EUR": r.emitido_valor_eur,
         "Recibido_Moneda": r.recibido_moneda,
-        "Recibido_Cantidad": str(r.recibido_cantidad),
+        "Recibido_Cantidad": r.recibido_cantidad,
         "Recibido_Valor_EUR": r.recibido_valor_eur,
         "Comision_Moneda": r.comision_moneda,
-        "Comision_Cantidad": str(r.comision_cantidad),
+        "Comision_Cantidad": r.comision_cantidad,
         "Comision_Valor_EUR": r.comision_valor_eur,
         "Declarable": r.declarable,
-    } for r in normalized])
+    } for r in normalized], dtype=object)
 	
     remove_negative_signs(df)
     check_coin_amounts_absolute(df)
     #convert_stables_in_df(df)
     translate_eur_values(df)
-    convert_no_stables_in_df(df)
-    procesar_df_con_fifo(df,CryptoFIFO())
+    return df
+
+
+def aplicar_fifo(df):
+    """FIFO según la configuración: por cierres anuales, en paralelo o secuencial."""
+    if FIFO_CHECKPOINTS:
+        # FIFO solo desde el último cierre anual válido; las filas
+        # anteriores recuperan sus resultados de los cierres
+        procesar_df_con_fifo_por_anios(df, CryptoFIFO(), FIFO_CHECKPOINTS, FIFO_WORKERS)
+        return df
+    if FIFO_WORKERS > 1:
+        procesar_df_con_fifo_paralelo(df, CryptoFIFO(), FIFO_WORKERS)
+    else:
+        procesar_df_con_fifo(df,CryptoFIFO())
+    return df
+
+
+def main():
+    getcontext().prec = 18
+    # ARLES_LOG_LEVEL=DEBUG muestra las trazas del FIFO
+    logging.basicConfig(level=os.environ.get("ARLES_LOG_LEVEL", "WARNING").upper(), format="%(message)s")
+    import sys
+    if len(sys.argv) < 4:
+        print("Uso: python parseador_binance_excel.py binance.csv coinbase.csv output.xlsx")
+        sys.exit(1)
+
+    binance_input = sys.argv[1]
+    coinbase_input = sys.argv[2]
+    output_path = sys.argv[3]
+
+    raw_rows, normalized = load_normalized_rows(binance_input, coinbase_input)
+
+    # Convertir a DataFrame y exportar a Excel
+    df = build_dataframe(normalized)
+    if LEDGER_DIR:
+        # Solo se valoran y pasan por FIFO las filas que el libro no tiene
+        df, totales = actualizar_libro(df, LEDGER_DIR, FIFO_WORKERS)
+    else:
+        prefetch_df_prices(df)
+        convert_no_stables_in_df(df)
+    price_cache = get_price_cache()
+    price_cache.flush()
+    print(f"Caché de precios: {price_cache.stats()}")
+    print(f"Precios por nivel: {get_provider_chain().stats()}")
+    print(f"Latencias por host: {get_client().stats()}")
+    if not LEDGER_DIR:
+        df = aplicar_fifo(df)
     	
-    df.to_excel(output_path, index=False)
+    if COST_METHODS:
+        # Comparativa de métodos de coste en una sola pasada extra
+        procesar_df_metodos(df, COST_METHODS)
+        with open("comparativa_metodos.txt", "w", encoding="utf-8") as f:
+            f.write(generar_comparativa_metodos_txt(df, COST_METHODS))
+
+    frame_to_decimal(df).to_excel(output_path, index=False)
     print(f"Procesadas {len(raw_rows)} filas -> {len(normalized)} operaciones normalizadas")
     print(f"Excel escrito en: {output_path}")
 
-    informe_txt = generar_informe_fiscal_base_ahorro_txt(df)
+    if LEDGER_DIR:
+        informe_txt = generar_informe_txt_base_ahorro(totales)
+    else:
+        informe_txt = generar_informe_fiscal_base_ahorro_txt(df)
 
     with open("informe_base_ahorro.txt", "w", encoding="utf-8") as f:
         f.write(informe_txt)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
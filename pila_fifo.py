@@ -1,7 +1,107 @@
+from bisect import bisect_right
 from collections import defaultdict, deque
 from decimal import Decimal
+from itertools import accumulate
 
-TOL = Decimal("0.00000002")
+from punto_fijo import amount_decimal, div_round, eur_decimal, to_amount, to_eur, unit_price
+
+TOL = 2  # 0.00000002 en unidades de 1e-8
+
+
+class Lote:
+    """
+    Lote en la cola de una cripto: fecha, cantidad (unidades de 1e-8) y
+    coste total (unidades de 1e-10). Sin __dict__ ni la cripto repetida:
+    la cripto es la clave de la cola.
+    """
+    __slots__ = ("fecha", "cantidad", "coste")
+
+    def __init__(self, fecha: str, cantidad: int, coste: int):
+        self.fecha = fecha
+        self.cantidad = cantidad
+        self.coste = coste
+
+    def __repr__(self):
+        return f"Lote({self.fecha!r}, {amount_decimal(self.cantidad)}, {eur_decimal(self.coste)})"
+
+
+class Salida:
+    """
+    Parte de un lote consumida por consume(registros=True). Guarda los
+    enteros necesarios y el texto del detalle solo se genera con str().
+    """
+    __slots__ = ("cripto", "fecha", "cantidad", "coste", "lote_cantidad", "lote_coste")
+
+    def __init__(self, cripto: str, fecha: str, cantidad: int, coste: int, lote_cantidad: int, lote_coste: int):
+        self.cripto = cripto
+        self.fecha = fecha                  # fecha de entrada del lote
+        self.cantidad = cantidad            # cantidad que sale
+        self.coste = coste                  # coste que sale
+        self.lote_cantidad = lote_cantidad  # lote antes de la salida
+        self.lote_coste = lote_coste
+
+    @property
+    def precio_unitario(self) -> Decimal:
+        return unit_price(self.lote_coste, self.lote_cantidad)
+
+    def __str__(self):
+        return (
+            f"Salida lote: {amount_decimal(self.cantidad)} {self.cripto} "
+            f"a {self.precio_unitario} EUR/u total: {eur_decimal(self.coste)}"
+        )
+
+    def __eq__(self, other):
+        return isinstance(other, Salida) and all(getattr(self, a) == getattr(other, a) for a in self.__slots__)
+
+    def __repr__(self):
+        return f"Salida({self})"
+
+
+def detalle_texto(salidas) -> list:
+    """Detalle como lo devuelve consume() por defecto: [{"Salida lote: ..."}, ...]."""
+    return [{str(salida)} for salida in salidas]
+
+
+class Entrada:
+    """Lote que entra en una fila; el texto solo se genera con str()."""
+    __slots__ = ("cripto", "cantidad", "coste")
+
+    def __init__(self, cripto: str, cantidad: int, coste: int):
+        self.cripto = cripto
+        self.cantidad = cantidad
+        self.coste = coste
+
+    def __str__(self):
+        return f"Entrada lote: {amount_decimal(self.cantidad)} {self.cripto} a {unit_price(self.coste, self.cantidad)} EUR/u"
+
+    def __eq__(self, other):
+        return isinstance(other, Entrada) and all(getattr(self, a) == getattr(other, a) for a in self.__slots__)
+
+
+class DetalleFIFO:
+    """
+    Detalle FIFO de una fila: las Salida consumidas (VENTA, PERMUTA) y la
+    Entrada del lote nuevo (entradas, PERMUTA). Se guarda tal cual en la
+    columna y str() da el texto de siempre al exportar.
+    """
+    __slots__ = ("salidas", "entrada")
+
+    def __init__(self, salidas=None, entrada: Entrada = None):
+        self.salidas = salidas
+        self.entrada = entrada
+
+    def __str__(self):
+        if self.salidas is None:
+            return str(self.entrada)
+        if self.entrada is None:
+            return str(detalle_texto(self.salidas))
+        return str({"salida": detalle_texto(self.salidas), "entrada": {str(self.entrada)}})
+
+    def __eq__(self, other):
+        return isinstance(other, DetalleFIFO) and (self.salidas, self.entrada) == (other.salidas, other.entrada)
+
+    def __repr__(self):
+        return f"DetalleFIFO({self})"
 
 
 class CryptoFIFO:
@@ -9,63 +109,180 @@ class CryptoFIFO:
         # Cada cripto tiene su cola FIFO de lotes
         self.lotes = defaultdict(deque)
 
-    def add(self, fecha: str, cripto: str, cantidad: Decimal, precio_unitario: Decimal):
+    def add(self, fecha: str, cripto: str, cantidad: int, coste: int):
         """
-        Añade un lote con fecha, cripto, cantidad y precio unitario en euros.
+        Añade un lote con fecha, cripto, cantidad (unidades de 1e-8) y
+        coste total en euros (unidades de 1e-10), ver punto_fijo.
         """
-        lote = {
-            "fecha": fecha,
-            "cripto": cripto.upper(),
-            "cantidad": cantidad,
-            "precio_unitario": precio_unitario
-        }
-        self.lotes[cripto.upper()].append(lote)
-
-    def consume(self, cripto: str, cantidad: Decimal):
+        self.lotes[cripto.upper()].append(Lote(fecha, cantidad, coste))
+
+    def consume(self, cripto: str, cantidad: int, registros: bool = False):
         """
-        Consume una cantidad de la cripto siguiendo FIFO.
-        Devuelve el coste total en euros y el detalle de lotes consumidos.
+        Consume una cantidad (unidades de 1e-8) de la cripto siguiendo FIFO.
+        Devuelve el coste total en euros (unidades de 1e-10) y el detalle de
+        lotes consumidos. Una salida parcial se lleva la parte proporcional
+        del coste del lote, redondeada, y el resto queda en el lote: las
+        salidas de un lote suman exactamente su coste.
+
+        Con registros=True el detalle es una lista de Salida, sin generar
+        texto; detalle_texto() la convierte al formato de siempre.
         """
         cripto = cripto.upper()
         if cripto not in self.lotes:
             raise ValueError(f"No hay registros para {cripto}")
 
-        coste_total = Decimal("0")
+        cola = self.lotes[cripto]
+        coste_total = 0
         restante = cantidad
-        detalle = []
+        salidas = []
 
-        while restante > 0 and self.lotes[cripto]:
-            lote = self.lotes[cripto][0]
-            cantidad = lote["cantidad"]
-            precio_unitario = lote["precio_unitario"]
+        while restante > 0 and cola:
+            lote = cola[0]
 
-            if lote["cantidad"] <= restante:
+            if lote.cantidad <= restante:
                 # Consumimos todo el lote
-                coste = lote["cantidad"] * lote["precio_unitario"]
-                coste_total += coste
-                
-                detalle.append({
-                    f"Salida lote: {cantidad} {cripto} a {precio_unitario} EUR/u total: {coste}"
-                })
-                restante -= lote["cantidad"]
-                self.lotes[cripto].popleft()
-            else: 
+                salidas.append(Salida(cripto, lote.fecha, lote.cantidad, lote.coste, lote.cantidad, lote.coste))
+                coste_total += lote.coste
+                restante -= lote.cantidad
+                cola.popleft()
+            else:
                 # Consumimos parte del lote
-                coste = restante * lote["precio_unitario"]
+                coste = div_round(lote.coste * restante, lote.cantidad)
+                salidas.append(Salida(cripto, lote.fecha, restante, coste, lote.cantidad, lote.coste))
                 coste_total += coste
-                detalle.append({
-                    f"Salida lote: {restante} {cripto} a {precio_unitario} EUR/u total: {coste}"
-                })
-                lote["cantidad"] -= restante
-                restante = Decimal("0")
- 
+                lote.cantidad -= restante
+                lote.coste -= coste
+                restante = 0
 
         if restante > 0:
-            print(f'Han faltado {restante} para recuperar{cantidad}')
+            print(f'Han faltado {amount_decimal(restante)} para recuperar{amount_decimal(cantidad)}')
             if restante > TOL: 
-                raise ValueError(f"No hay suficiente {cripto} para consumir {cantidad} restante a {restante}")
- 
-        return coste_total, detalle
+                raise ValueError(
+                    f"No hay suficiente {cripto} para consumir {amount_decimal(cantidad)} "
+                    f"restante a {amount_decimal(restante)}"
+                )
+
+        return coste_total, (salidas if registros else detalle_texto(salidas))
+
+    def consume_batch(self, cripto: str, operaciones, registros: bool = False, detalle: bool = True) -> list:
+        """
+        Aplica de una vez las operaciones de una cripto en orden cronológico:
+            ("add", fecha, cantidad, coste)
+            ("consume", cantidad)
+        y devuelve, por cada "consume", el mismo (coste_total, detalle) que
+        daría llamar a add/consume una a una, con el mismo estado final.
+
+        En lugar de recorrer la cola lote a lote, se acumulan las cantidades
+        de los lotes (sumas prefijas) y los límites de cada salida se buscan
+        con bisect; solo los lotes en el borde de una salida se reparten con
+        div_round, y el coste de los lotes enteros intermedios sale de las
+        sumas prefijas de coste. Con detalle=False no se generan registros
+        (el detalle es None) y cada salida cuesta O(log n).
+        """
+        cripto = cripto.upper()
+        cola = self.lotes[cripto] if cripto in self.lotes else None
+        lotes = list(cola) if cola is not None else []
+        salidas_pedidas = []            # (cantidad, lotes disponibles)
+        for op in operaciones:
+            if op[0] == "add":
+                lotes.append(Lote(op[1], op[2], op[3]))
+            elif op[0] == "consume":
+                salidas_pedidas.append((op[1], len(lotes)))
+            else:
+                raise ValueError(f"Operación desconocida: {op[0]}")
+
+        fin = list(accumulate((l.cantidad for l in lotes), initial=0))
+        costes = list(accumulate((l.coste for l in lotes), initial=0))
+
+        def resultado(coste_total, salidas):
+            if not detalle:
+                return coste_total, None
+            return coste_total, (salidas if registros else detalle_texto(salidas))
+
+        cabeza = 0          # primer lote con saldo
+        coste_cabeza = None  # coste restante de la cabeza si ya se tocó
+        consumido = 0       # cantidad consumida desde el primer lote
+        resultados = []
+
+        def guardar(n_lotes):
+            # Estado final de la cola con los n_lotes primeros lotes añadidos
+            if cola is None and n_lotes == 0:
+                return
+            quedan = lotes[cabeza:n_lotes]
+            if quedan and coste_cabeza is not None:
+                quedan[0].cantidad = fin[cabeza + 1] - consumido
+                quedan[0].coste = coste_cabeza
+            self.lotes[cripto] = deque(quedan)
+
+        for cantidad, disponibles in salidas_pedidas:
+            if disponibles == 0 and cola is None:
+                guardar(0)
+                raise ValueError(f"No hay registros para {cripto}")
+
+            pedida = cantidad
+            if consumido + cantidad > fin[disponibles]:
+                restante = consumido + cantidad - fin[disponibles]
+                print(f'Han faltado {amount_decimal(restante)} para recuperar{amount_decimal(pedida)}')
+                if restante > TOL:
+                    # consume() vacía la cola antes de fallar
+                    cabeza, coste_cabeza, consumido = disponibles, None, fin[disponibles]
+                    guardar(disponibles)
+                    raise ValueError(
+                        f"No hay suficiente {cripto} para consumir {amount_decimal(pedida)} "
+                        f"restante a {amount_decimal(restante)}"
+                    )
+                cantidad = fin[disponibles] - consumido
+
+            if cantidad <= 0:
+                resultados.append(resultado(0, []))
+                continue
+
+            hasta = consumido + cantidad
+            ultimo = bisect_right(fin, hasta - 1) - 1
+            salidas = []
+
+            # Lote de cabeza, quizá ya tocado por una salida anterior
+            lote = lotes[cabeza]
+            resto_cantidad = fin[cabeza + 1] - consumido
+            resto_coste = lote.coste if coste_cabeza is None else coste_cabeza
+            if ultimo > cabeza or hasta == fin[cabeza + 1]:
+                coste_total = resto_coste
+                salidas.append(Salida(cripto, lote.fecha, resto_cantidad, resto_coste, resto_cantidad, resto_coste))
+            else:
+                coste_total = div_round(resto_coste * cantidad, resto_cantidad)
+                salidas.append(Salida(cripto, lote.fecha, cantidad, coste_total, resto_cantidad, resto_coste))
+                coste_cabeza = resto_coste - coste_total
+                consumido = hasta
+                resultados.append(resultado(coste_total, salidas))
+                continue
+
+            if ultimo > cabeza:
+                # Lotes enteros intermedios
+                coste_total += costes[ultimo] - costes[cabeza + 1]
+                if detalle:
+                    salidas.extend(
+                        Salida(cripto, l.fecha, l.cantidad, l.coste, l.cantidad, l.coste)
+                        for l in lotes[cabeza + 1:ultimo]
+                    )
+                # Último lote, entero o en parte
+                lote = lotes[ultimo]
+                tomada = hasta - fin[ultimo]
+                if tomada == lote.cantidad:
+                    coste_total += lote.coste
+                    salidas.append(Salida(cripto, lote.fecha, tomada, lote.coste, lote.cantidad, lote.coste))
+                else:
+                    coste = div_round(lote.coste * tomada, lote.cantidad)
+                    coste_total += coste
+                    salidas.append(Salida(cripto, lote.fecha, tomada, coste, lote.cantidad, lote.coste))
+                    cabeza, coste_cabeza, consumido = ultimo, lote.coste - coste, hasta
+                    resultados.append(resultado(coste_total, salidas))
+                    continue
+
+            cabeza, coste_cabeza, consumido = ultimo + 1, None, hasta
+            resultados.append(resultado(coste_total, salidas))
+
+        guardar(len(lotes))
+        return resultados
 
 # -------------------------
 # Bloque de prueba rápida
@@ -73,12 +290,12 @@ class CryptoFIFO:
 if __name__ == "__main__":
     fifo = CryptoFIFO()
 
-    fifo.add("2023-01-01", "BTC", Decimal("0.5"), Decimal("20000"))
-    fifo.add("2023-02-01", "BTC", Decimal("0.5"), Decimal("25000"))
-    fifo.add("2023-03-01", "ETH", Decimal("10"), Decimal("1500"))
+    fifo.add("2023-01-01", "BTC", to_amount(Decimal("0.5")), to_eur(Decimal("10000")))
+    fifo.add("2023-02-01", "BTC", to_amount(Decimal("0.5")), to_eur(Decimal("12500")))
+    fifo.add("2023-03-01", "ETH", to_amount(Decimal("10")), to_eur(Decimal("15000")))
 
-    coste, detalle = fifo.consume("BTC", Decimal("0.7"))
-    print("Coste total:", coste)
+    coste, detalle = fifo.consume("BTC", to_amount(Decimal("0.7")))
+    print("Coste total:", eur_decimal(coste))
     print("Detalle de lotes consumidos:")
     for d in detalle:
         print(d)
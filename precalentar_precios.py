@@ -0,0 +1,90 @@
+"""
+Precalentado de la caché de precios antes de la campaña.
+
+Recibe los mismos CSV que parseador-binance.py, ejecuta solo el parseo y
+la normalización, calcula las claves (symbol, quote, minute) con la
+resolución de ARLES_PRICE_RESOLUTION y las fechas USD/EUR que necesitará
+la valoración y descarga en bloque las que falten al almacén de precios.
+Cada tanda descargada se guarda al terminar, así que si se interrumpe
+basta con volver a lanzarlo. Después el informe se puede ejecutar sin
+red (ARLES_OFFLINE=1).
+
+Uso: python precalentar_precios.py binance.csv coinbase.csv [--pares]
+    --pares  descarga antes la lista de pares de Binance (exchangeInfo)
+"""
+import importlib.util
+import os
+import sys
+from decimal import getcontext
+
+from bce_api import (
+    collect_binance_price_keys, collect_usd_eur_days, get_local_usd_to_eur_rate,
+    get_price_cache, get_provider_chain, prefetch_df_prices,
+    prefetch_usd_eur_rates, refresh_exchange_pairs,
+)
+from cliente_http import get_client
+
+
+def _load_parser():
+    # El nombre del script lleva guion y no se puede importar directamente
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parseador-binance.py")
+    spec = importlib.util.spec_from_file_location("parseador_binance", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def warmup(binance_input: str, coinbase_input: str, refresh_pairs: bool = False) -> dict:
+    """
+    Descarga todo lo que la valoración de estos CSV va a necesitar.
+    Devuelve las estadísticas de cada precarga y las claves y fechas
+    que aún no se resuelven sin red.
+    """
+    parser = _load_parser()
+    _, normalized = parser.load_normalized_rows(binance_input, coinbase_input)
+    df = parser.build_dataframe(normalized)
+
+    if refresh_pairs:
+        refresh_exchange_pairs()
+
+    days = collect_usd_eur_days(df)
+    binance_stats = prefetch_df_prices(df)
+    usd_eur_stats = prefetch_usd_eur_rates(days)
+    get_price_cache().flush()
+
+    chain = get_provider_chain()
+    pending = sorted(
+        k for k in collect_binance_price_keys(df)
+        if chain.lookup(*k[:3], network=False) is None
+    )
+    pending_days = sorted(d for d in days if get_local_usd_to_eur_rate(d) is None)
+    return {
+        "binance": binance_stats,
+        "usd_eur": usd_eur_stats,
+        "pending": pending,
+        "pending_days": pending_days,
+    }
+
+
+def main():
+    getcontext().prec = 18
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    if len(args) < 2:
+        print("Uso: python precalentar_precios.py binance.csv coinbase.csv [--pares]")
+        sys.exit(1)
+
+    result = warmup(args[0], args[1], refresh_pairs="--pares" in sys.argv)
+
+    print(f"Latencias por host: {get_client().stats()}")
+    if result["pending"] or result["pending_days"]:
+        print(f"Quedan {len(result['pending'])} claves sin precio, p. ej.:")
+        for key in result["pending"][:20]:
+            print("  " + " ".join(key))
+        print(f"Quedan {len(result['pending_days'])} fechas sin tipo USD/EUR: {result['pending_days'][:20]}")
+        print("Vuelva a lanzar el precalentado para reanudar.")
+        sys.exit(2)
+    print("Caché lista: la valoración no necesitará red")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+import abc
+import threading
+import time
+from decimal import Decimal
+from typing import Callable, Dict, List, Optional, Sequence
+
+
+class TierStats:
+    """Contadores de un nivel de la cadena."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.seconds = 0.0
+
+    def as_dict(self) -> dict:
+        calls = self.hits + self.misses + self.errors
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "seconds": round(self.seconds, 3),
+            "avg_ms": round(self.seconds * 1000 / calls, 3) if calls else 0.0,
+        }
+
+
+class PriceProvider(abc.ABC):
+    """
+    Un nivel de la cadena de precios. get() devuelve el precio o None si
+    este nivel no lo tiene. Los errores que no signifiquen "no lo tengo"
+    deben propagarse. Los bytes de red los cuenta cliente_http por host.
+    """
+
+    name = "base"
+    network = False          # desactivable en ejecuciones reproducibles
+    persist_hits = False     # sus aciertos se guardan en el almacén
+    remember_hits = True     # sus aciertos se memorizan bajo el minuto pedido
+    unlisted = False         # también sirve activos sin ruta de pares en el exchange
+
+    @abc.abstractmethod
+    def get(self, symbol: str, quote: str, minute: str) -> Optional[Decimal]:
+        """Precio de symbol en quote en ese minuto, o None."""
+
+
+class MemoryProvider(PriceProvider):
+    """Caché del proceso (PriceCache)."""
+
+    name = "memory"
+    unlisted = True          # guarda también lo que sirvió coingecko
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def get(self, symbol, quote, minute):
+        return self.cache.get_price(symbol, quote, minute)
+
+
+class StoreProvider(PriceProvider):
+    """
+    Lectura directa del almacén SQLite: encuentra lo que otros procesos
+    hayan escrito después de que la caché cargase el almacén.
+    """
+
+    name = "store"
+
+    def __init__(self, store):
+        self.store = store
+
+    def get(self, symbol, quote, minute):
+        close = self.store.get_price(symbol, quote, minute)
+        return None if close is None else Decimal(close)
+
+
+class ArchiveProvider(PriceProvider):
+    """Archivo offline de velas de 1 minuto (archivo_klines)."""
+
+    name = "archive"
+
+    def __init__(self, archive, minute_to_ms: Callable[[str], int]):
+        self.archive = archive
+        self.minute_to_ms = minute_to_ms
+
+    def get(self, symbol, quote, minute):
+        return self.archive.close_at(f"{symbol}{quote}".upper(), self.minute_to_ms(minute))
+
+
+class BinanceProvider(PriceProvider):
+    """
+    Velas de 1 minuto de /api/v3/klines. fetch(pair, minute) devuelve la
+    lista de velas.
+    """
+
+    name = "binance"
+    network = True
+    persist_hits = True
+
+    def __init__(self, fetch: Callable[[str, str], list], minute_to_ms: Callable[[str], int]):
+        self.fetch = fetch
+        self.minute_to_ms = minute_to_ms
+
+    def get(self, symbol, quote, minute):
+        data = self.fetch(f"{symbol}{quote}".upper(), minute)
+        # Vela de 1 minuto: [open_time, open, high, low, close, volume, ...]
+        # Si el minuto no tiene vela, Binance devuelve la siguiente
+        if not data or data[0][0] != self.minute_to_ms(minute):
+            return None
+        return Decimal(data[0][4])
+
+
+class CoinGeckoProvider(PriceProvider):
+    """
+    Precio diario de CoinGecko (/coins/{id}/history), último recurso para
+    activos sin par en Binance. Solo sirve monedas con id conocido.
+    """
+
+    name = "coingecko"
+    network = True
+    unlisted = True
+    persist_hits = False     # precio diario: no se guarda como vela de 1 minuto
+
+    IDS = {
+        "BTC": "bitcoin", "ETH": "ethereum", "BNB": "binancecoin", "ADA": "cardano",
+        "SOL": "solana", "XRP": "ripple", "USDT": "tether", "USDC": "usd-coin",
+        "TRUMP": "official-trump",
+    }
+
+    def __init__(self, fetch: Callable[[str, str, str], Decimal]):
+        self.fetch = fetch
+
+    def get(self, symbol, quote, minute):
+        asset_id = self.IDS.get(symbol.upper())
+        if asset_id is None:
+            return None
+        # CoinGecko usa DD-MM-YYYY
+        date_str = f"{minute[8:10]}-{minute[5:7]}-{minute[0:4]}"
+        try:
+            return self.fetch(asset_id, date_str, quote.lower())
+        except ValueError:
+            return None
+
+
+class GapFills:
+    """
+    Huecos rellenados: (symbol, quote, minuto pedido) -> minuto de la vela
+    servida en su lugar. on_record persiste cada relleno nuevo.
+    """
+
+    def __init__(self, known: Optional[dict] = None, on_record: Optional[Callable] = None):
+        self.served: Dict[tuple, str] = dict(known or {})
+        self.on_record = on_record
+        self._lock = threading.Lock()
+
+    def get(self, symbol: str, quote: str, minute: str) -> Optional[str]:
+        return self.served.get((symbol.upper(), quote.upper(), minute))
+
+    def record(self, symbol: str, quote: str, minute: str, served: str):
+        key = (symbol.upper(), quote.upper(), minute)
+        with self._lock:
+            if self.served.get(key) == served:
+                return
+            self.served[key] = served
+        if self.on_record:
+            self.on_record(*key, served)
+
+    def __len__(self) -> int:
+        return len(self.served)
+
+
+class KnownGapProvider(PriceProvider):
+    """
+    Minutos sin vela ya rellenados (en esta ejecución o en otra): sirve el
+    cierre de la vela registrada sin volver a la red.
+    """
+
+    name = "gaps"
+    remember_hits = False    # el precio es de otro minuto: solo vale vía fills
+
+    def __init__(self, fills: GapFills, price_at: Callable[[str, str, str], Optional[Decimal]]):
+        self.fills = fills
+        self.price_at = price_at
+
+    def get(self, symbol, quote, minute):
+        served = self.fills.get(symbol, quote, minute)
+        if served is None:
+            return None
+        return self.price_at(symbol, quote, served)
+
+
+class GapFillProvider(PriceProvider):
+    """
+    Último recurso cuando el minuto exacto no tiene vela (pares poco
+    líquidos): una sola petición por rango de ±window minutos y se sirve
+    la vela anterior más cercana. fetch_window(symbol, quote, minute, window)
+    devuelve [(minuto, cierre)] ordenado.
+    """
+
+    name = "gapfill"
+    network = True
+    remember_hits = False    # el precio es de otro minuto: solo vale vía fills
+
+    def __init__(self, fills: GapFills, fetch_window: Callable, window: int):
+        self.fills = fills
+        self.fetch_window = fetch_window
+        self.window = window
+
+    def get(self, symbol, quote, minute):
+        candles = self.fetch_window(symbol, quote, minute, self.window)
+        earlier = [c for c in candles if c[0] <= minute]
+        if not earlier:
+            return None
+        served, price = earlier[-1]
+        if served != minute:
+            self.fills.record(symbol, quote, minute, served)
+        return price
+
+
+class ProviderChain:
+    """
+    Cadena de niveles consultados en orden de prioridad. El primer acierto
+    gana; si no viene de memoria se memoriza con remember(), y si viene de
+    la red además se marca para guardar en el almacén. Los niveles de
+    huecos no se memorizan: su precio es el de otra vela.
+    is_miss(symbol, quote, error) dice qué errores de un nivel significan "no lo tengo"
+    (p. ej. par inexistente): cuentan como fallo y se sigue con los
+    niveles siguientes; si ninguno lo tiene se relanza el primero.
+    Cada nivel acumula aciertos, fallos, errores y tiempo.
+    """
+
+    def __init__(
+        self, providers: Sequence[PriceProvider], remember: Optional[Callable] = None,
+        is_miss: Optional[Callable[[str, str, Exception], bool]] = None,
+    ):
+        self.providers: List[PriceProvider] = list(providers)
+        self.remember = remember
+        self.is_miss = is_miss
+        self.tier_stats: Dict[str, TierStats] = {p.name: TierStats() for p in self.providers}
+        self._lock = threading.Lock()
+
+    @property
+    def network_enabled(self) -> bool:
+        return any(p.network for p in self.providers)
+
+    def has(self, name: str) -> bool:
+        return any(p.name == name for p in self.providers)
+
+    def unlisted_tiers(self) -> List[str]:
+        """Niveles que sirven activos sin ruta de pares (memoria, coingecko)."""
+        return [p.name for p in self.providers if p.unlisted]
+
+    def lookup(
+        self, symbol: str, quote: str, minute: str, network: bool = True,
+        only: Optional[Sequence[str]] = None,
+    ) -> Optional[Decimal]:
+        """Precio del primer nivel que lo tenga (de entre only, si se da), o None."""
+        miss_error = None
+        for provider in self.providers:
+            if provider.network and not network:
+                continue
+            if only is not None and provider.name not in only:
+                continue
+            stats = self.tier_stats[provider.name]
+            start = time.perf_counter()
+            try:
+                price = provider.get(symbol, quote, minute)
+            except Exception as e:
+                miss = self.is_miss is not None and self.is_miss(symbol, quote, e)
+                with self._lock:
+                    if miss:
+                        stats.misses += 1
+                    else:
+                        stats.errors += 1
+                    stats.seconds += time.perf_counter() - start
+                if not miss:
+                    raise
+                miss_error = miss_error or e
+                continue
+            with self._lock:
+                stats.seconds += time.perf_counter() - start
+                if price is None:
+                    stats.misses += 1
+                    continue
+                stats.hits += 1
+
+            if self.remember and provider.name != "memory" and provider.remember_hits:
+                self.remember(symbol, quote, minute, price, persist=provider.persist_hits)
+            return price
+        if miss_error is not None:
+            raise miss_error
+        return None
+
+    def get(self, symbol: str, quote: str, minute: str) -> Decimal:
+        price = self.lookup(symbol, quote, minute)
+        if price is None:
+            raise ValueError(f"No hay datos para {symbol.upper()}{quote.upper()} en {minute}")
+        return price
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {name: s.as_dict() for name, s in self.tier_stats.items()}
@@ -0,0 +1,132 @@
+"""
+Representación en punto fijo de cantidades y valores.
+
+Las cantidades de cripto viajan como enteros en unidades de 1e-8 (el
+satoshi) y los valores en EUR como enteros en unidades de 1e-10. Se
+convierten una sola vez al leer los CSV y se vuelven a Decimal solo al
+exportar (Excel, informe). Son enteros de Python y no int64: con 8
+decimales una cantidad de cien mil millones de tokens ya no cabe en 64
+bits. Un valor ausente es None.
+"""
+import math
+from decimal import ROUND_HALF_EVEN, Decimal, InvalidOperation, localcontext
+from numbers import Integral
+from typing import Optional
+
+AMOUNT_DIGITS = 8
+EUR_DIGITS = 10
+AMOUNT_SCALE = 10 ** AMOUNT_DIGITS
+EUR_SCALE = 10 ** EUR_DIGITS
+
+AMOUNT_COLUMNS = ("Emitido_Cantidad", "Recibido_Cantidad", "Comision_Cantidad")
+EUR_COLUMNS = (
+    "Emitido_Valor_EUR", "Recibido_Valor_EUR", "Comision_Valor_EUR",
+    "Valor Adquisicion", "Valor Transmision",
+)
+
+
+def _to_fixed(value, digits: int) -> Optional[int]:
+    if value is None:
+        return None
+    if isinstance(value, Integral):
+        raise TypeError("Los enteros ya están en punto fijo; use Decimal o texto")
+    if isinstance(value, float):
+        if math.isnan(value):
+            return None
+        value = repr(value)
+    if not isinstance(value, Decimal):
+        value = str(value).strip()
+        if value == "" or value.lower() in ("nan", "none"):
+            return None
+        try:
+            value = Decimal(value)
+        except InvalidOperation:
+            return None
+    with localcontext() as ctx:
+        ctx.prec = 60
+        return int(value.scaleb(digits).to_integral_value(ROUND_HALF_EVEN))
+
+
+def to_amount(value) -> Optional[int]:
+    """Cantidad (Decimal, texto o float) -> unidades de 1e-8; None si falta."""
+    return _to_fixed(value, AMOUNT_DIGITS)
+
+
+def to_eur(value) -> Optional[int]:
+    """Valor en EUR (Decimal, texto o float) -> unidades de 1e-10; None si falta."""
+    return _to_fixed(value, EUR_DIGITS)
+
+
+def _plain(value: Decimal) -> Decimal:
+    # Sin ceros finales ni exponente: 1.50000000 -> 1.5, 1E+3 -> 1000
+    with localcontext() as ctx:
+        ctx.prec = 60
+        value = value.normalize()
+        return value.quantize(Decimal(1)) if value == value.to_integral_value() else value
+
+
+def _to_decimal(units: Optional[int], digits: int) -> Optional[Decimal]:
+    # Mismo resultado que _plain(Decimal(units).scaleb(-digits)), desde el
+    # texto de los dígitos: exacto y sin contexto decimal, mucho más rápido
+    if units is None:
+        return None
+    entero, fraccion = divmod(abs(units), 10 ** digits)
+    signo = "-" if units < 0 else ""
+    fraccion = str(fraccion).rjust(digits, "0").rstrip("0")
+    return Decimal(f"{signo}{entero}.{fraccion}" if fraccion else f"{signo}{entero}")
+
+
+def amount_decimal(units: Optional[int]) -> Optional[Decimal]:
+    return _to_decimal(units, AMOUNT_DIGITS)
+
+
+def eur_decimal(units: Optional[int]) -> Optional[Decimal]:
+    return _to_decimal(units, EUR_DIGITS)
+
+
+def div_round(numerator: int, denominator: int) -> int:
+    """numerator / denominator redondeado al entero par más cercano."""
+    quotient, remainder = divmod(numerator, denominator)
+    twice = 2 * remainder
+    if denominator < 0:
+        twice, denominator = -twice, -denominator
+    if twice > denominator or (twice == denominator and quotient % 2):
+        quotient += 1
+    return quotient
+
+
+def amount_as_eur(units: Optional[int]) -> Optional[int]:
+    """Cantidad de EUR (1e-8) -> valor en EUR (1e-10)."""
+    return None if units is None else units * 10 ** (EUR_DIGITS - AMOUNT_DIGITS)
+
+
+def eur_value(price: Decimal, units: int) -> int:
+    """price (EUR por unidad) * cantidad en unidades de 1e-8 -> valor en 1e-10."""
+    with localcontext() as ctx:
+        ctx.prec = 60
+        value = (price * units).scaleb(EUR_DIGITS - AMOUNT_DIGITS)
+        return int(value.to_integral_value(ROUND_HALF_EVEN))
+
+
+def unit_price(value_units: int, amount_units: int) -> Decimal:
+    """Precio unitario en EUR de un lote, solo para mostrarlo."""
+    return _plain(eur_decimal(value_units) / amount_decimal(amount_units))
+
+
+def frame_to_decimal(df):
+    """
+    Copia del DataFrame con las columnas de punto fijo en Decimal y los
+    detalles (DetalleFIFO...) como texto, para exportar a Excel.
+    """
+    out = df.copy()
+    for column in AMOUNT_COLUMNS:
+        if column in out.columns:
+            out[column] = [amount_decimal(int(v)) if isinstance(v, Integral) else v for v in out[column]]
+    for column in out.columns:
+        # También "Valor Adquisicion FIFO", "Valor Adquisicion LIFO"... (metodos_coste)
+        if column in EUR_COLUMNS or str(column).startswith("Valor Adquisicion "):
+            out[column] = [eur_decimal(int(v)) if isinstance(v, Integral) else v for v in out[column]]
+        # "Detalle FIFO" y "Detalle <método>": registros que se pasan a texto aquí
+        if str(column).startswith("Detalle "):
+            out[column] = [v if v is None or isinstance(v, str) else str(v) for v in out[column]]
+    return out
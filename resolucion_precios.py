@@ -0,0 +1,89 @@
+from decimal import Decimal
+from typing import Callable, Dict, Optional
+
+
+# Duración de cada resolución de vela admitida
+INTERVAL_MS = {"1m": 60_000, "1h": 3_600_000, "1d": 86_400_000}
+
+
+def _check_interval(interval: str) -> str:
+    if interval not in INTERVAL_MS:
+        raise ValueError(f"Resolución de precio desconocida: {interval} (válidas: {', '.join(INTERVAL_MS)})")
+    return interval
+
+
+class ResolutionPolicy:
+    """
+    Resolución de vela con la que se valora cada pata de una fila.
+
+    Por orden de prioridad:
+        by_asset       {"BNB": "1d"}       por moneda de la pata
+        by_tipo        {"REWARDS": "1d"}   por Tipo de la operación
+        threshold_eur  patas cuyo valor estimado (a precio diario) sea
+                       menor que el umbral usan threshold_resolution
+    y si no aplica ninguna, default.
+
+    La política por defecto lo valora todo a 1 minuto, como siempre.
+    """
+
+    def __init__(
+        self,
+        by_asset: Optional[Dict[str, str]] = None,
+        by_tipo: Optional[Dict[str, str]] = None,
+        threshold_eur: Optional[Decimal] = None,
+        threshold_resolution: str = "1d",
+        default: str = "1m",
+    ):
+        self.by_asset = {k.upper(): _check_interval(v) for k, v in (by_asset or {}).items()}
+        self.by_tipo = {k: _check_interval(v) for k, v in (by_tipo or {}).items()}
+        self.threshold_eur = Decimal(str(threshold_eur)) if threshold_eur is not None else None
+        self.threshold_resolution = _check_interval(threshold_resolution)
+        self.default = _check_interval(default)
+
+    @classmethod
+    def from_spec(cls, spec: str) -> "ResolutionPolicy":
+        """
+        Política desde texto, reglas separadas por comas:
+            asset:BNB=1d, tipo:REWARDS=1d, eur<25=1d, default=1m
+        """
+        by_asset, by_tipo = {}, {}
+        threshold, threshold_resolution, default = None, "1d", "1m"
+        for rule in filter(None, (r.strip() for r in spec.split(","))):
+            target, sep, interval = rule.rpartition("=")
+            if not sep:
+                raise ValueError(f"Regla de resolución sin '=': {rule}")
+            target = target.strip()
+            interval = interval.strip()
+            if target.lower().startswith("asset:"):
+                by_asset[target[6:].strip()] = interval
+            elif target.lower().startswith("tipo:"):
+                by_tipo[target[5:].strip()] = interval
+            elif target.lower().startswith("eur<"):
+                threshold, threshold_resolution = Decimal(target[4:].strip()), interval
+            elif target.lower() == "default":
+                default = interval
+            else:
+                raise ValueError(f"Regla de resolución desconocida: {rule}")
+        return cls(by_asset, by_tipo, threshold, threshold_resolution, default)
+
+    @property
+    def is_default(self) -> bool:
+        return not self.by_asset and not self.by_tipo and self.threshold_eur is None and self.default == "1m"
+
+    def resolve(self, asset: str, tipo: str, value_eur: Callable[[], Optional[Decimal]]) -> str:
+        """
+        Resolución de una pata. value_eur() solo se llama si hay umbral y
+        debe devolver el valor estimado en EUR de la pata (o None si no se
+        puede estimar, en cuyo caso no se aplica el umbral).
+        """
+        interval = self.by_asset.get(str(asset).upper())
+        if interval:
+            return interval
+        interval = self.by_tipo.get(tipo)
+        if interval:
+            return interval
+        if self.threshold_eur is not None:
+            value = value_eur()
+            if value is not None and abs(value) < self.threshold_eur:
+                return self.threshold_resolution
+        return self.default
@@ -0,0 +1,294 @@
+"""
+Servidor local que suplanta a Binance, Frankfurter y CoinGecko.
+
+Sirve desde un casete JSON grabado:
+    /api/v3/klines, /api/v3/exchangeInfo      (Binance)
+    /frankfurter/<fecha>, /frankfurter/<ini>..<fin>
+    /coingecko/api/v3/coins/<id>/history
+
+En modo grabación, lo que no está en el casete se pide a la API real y se
+añade al casete. Se puede inyectar latencia y respuestas 429 para medir
+concurrencia, precargas y el regulador de peticiones sin red.
+
+Uso:
+    python servidor_simulado.py casete.json [--grabar] [--puerto 8765]
+                                [--latencia 0.05] [--error-429 0.1]
+
+y en la ejecución a medir:
+    ARLES_BINANCE_URL=http://127.0.0.1:8765
+    ARLES_FRANKFURTER_URL=http://127.0.0.1:8765/frankfurter
+    ARLES_COINGECKO_URL=http://127.0.0.1:8765/coingecko/api/v3
+"""
+import json
+import os
+import random
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+
+UPSTREAM = {
+    "binance": "https://api.binance.com",
+    "frankfurter": "https://api.frankfurter.app",
+    "coingecko": "https://api.coingecko.com",
+}
+
+
+class Cassette:
+    """
+    Fixtures grabadas:
+        klines           {"BTCEUR|1m": [[open_time, open, high, low, close, ...], ...]}
+        invalid_symbols  ["USDTEUR", ...]
+        usd_eur          {"2024-01-02": 0.91}
+        raw              {"/ruta?query": {"status": 200, "body": ...}}
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.data = {"klines": {}, "invalid_symbols": [], "usd_eur": {}, "raw": {}}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.data.update(json.load(f))
+        self._index = {}
+        self.dirty = False
+        self._lock = threading.Lock()
+
+    def _candles(self, series: str) -> tuple:
+        if series not in self._index:
+            candles = sorted(self.data["klines"].get(series, []), key=lambda c: c[0])
+            self._index[series] = ([c[0] for c in candles], candles)
+        return self._index[series]
+
+    def klines(self, symbol: str, interval: str, start: int, end: int, limit: int) -> Optional[list]:
+        with self._lock:
+            if symbol in self.data["invalid_symbols"]:
+                return None
+            times, candles = self._candles(f"{symbol}|{interval}")
+            return candles[bisect_left(times, start):bisect_right(times, end)][:limit]
+
+    def add_klines(self, symbol: str, interval: str, candles: list):
+        with self._lock:
+            series = f"{symbol}|{interval}"
+            merged = {c[0]: c for c in self.data["klines"].get(series, [])}
+            merged.update({c[0]: c for c in candles})
+            self.data["klines"][series] = sorted(merged.values(), key=lambda c: c[0])
+            self._index.pop(series, None)
+            self.dirty = True
+
+    def add_invalid_symbol(self, symbol: str):
+        with self._lock:
+            if symbol not in self.data["invalid_symbols"]:
+                self.data["invalid_symbols"].append(symbol)
+                self.dirty = True
+
+    def add_rates(self, rates: dict):
+        with self._lock:
+            self.data["usd_eur"].update(rates)
+            self.dirty = True
+
+    def add_raw(self, key: str, status: int, body):
+        with self._lock:
+            self.data["raw"][key] = {"status": status, "body": body}
+            self.dirty = True
+
+    def save(self):
+        with self._lock:
+            if not self.dirty:
+                return
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.data, f, sort_keys=True)
+            os.replace(tmp, self.path)
+            self.dirty = False
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"       # keep-alive, como las APIs reales
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, body, headers: Optional[dict] = None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        server: "StandInServer" = self.server
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+        if server.latency:
+            time.sleep(server.latency * random.uniform(0.5, 1.5))
+
+        weight = server.add_weight(2 if url.path == "/api/v3/klines" else 1)
+        headers = {"X-MBX-USED-WEIGHT-1m": weight}
+        if server.error_429 and random.random() < server.error_429:
+            server.count("429")
+            self._send(429, {"code": -1003, "msg": "Too many requests."}, {**headers, "Retry-After": 1})
+            return
+
+        try:
+            status, body = server.resolve(url.path, query, url.query)
+        except requests.RequestException as e:
+            status, body = 502, {"msg": str(e)}
+        server.count(str(status))
+        self._send(status, body, headers)
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, cassette: Cassette, port: int = 0, record: bool = False,
+                 latency: float = 0.0, error_429: float = 0.0):
+        super().__init__(("127.0.0.1", port), StandInHandler)
+        self.cassette = cassette
+        self.record = record
+        self.latency = latency
+        self.error_429 = error_429
+        self.counters = {}
+        self._weight = (0, 0)            # (minuto, peso usado)
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def env(self) -> dict:
+        """Variables de entorno que dirigen bce_api a este servidor."""
+        return {
+            "ARLES_BINANCE_URL": self.base_url,
+            "ARLES_FRANKFURTER_URL": f"{self.base_url}/frankfurter",
+            "ARLES_COINGECKO_URL": f"{self.base_url}/coingecko/api/v3",
+        }
+
+    def add_weight(self, weight: int) -> int:
+        with self._lock:
+            minute = int(time.time() // 60)
+            used = (self._weight[1] if self._weight[0] == minute else 0) + weight
+            self._weight = (minute, used)
+            return used
+
+    def count(self, name: str):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def _upstream(self, service: str, path: str, query: str) -> requests.Response:
+        return requests.get(f"{UPSTREAM[service]}{path}?{query}", timeout=15)
+
+    def resolve(self, path: str, query: dict, raw_query: str) -> tuple:
+        raw_key = f"{path}?{raw_query}"
+        recorded = self.cassette.data["raw"].get(raw_key)
+        if recorded is not None:
+            return recorded["status"], recorded["body"]
+
+        if path == "/api/v3/klines":
+            return self._klines(query, raw_query)
+        if path.startswith("/frankfurter/"):
+            return self._frankfurter(path[len("/frankfurter"):], query, raw_query)
+        if path.startswith("/coingecko/") or path == "/api/v3/exchangeInfo":
+            return self._passthrough(path, raw_query)
+        return 404, {"msg": f"Ruta no simulada: {path}"}
+
+    def _klines(self, query: dict, raw_query: str) -> tuple:
+        symbol, interval = query["symbol"], query.get("interval", "1m")
+        start, end = int(query.get("startTime", 0)), int(query.get("endTime", 2**62))
+        limit = int(query.get("limit", 500))
+
+        candles = self.cassette.klines(symbol, interval, start, end, limit)
+        if candles is None:
+            return 400, {"code": -1121, "msg": "Invalid symbol."}
+        if candles or not self.record:
+            return 200, candles
+
+        response = self._upstream("binance", "/api/v3/klines", raw_query)
+        if response.status_code == 400:
+            # Solo -1121 es un par inexistente; otros 400 no se graban
+            if response.json().get("code") == -1121:
+                self.cassette.add_invalid_symbol(symbol)
+            return 400, response.json()
+        response.raise_for_status()
+        self.cassette.add_klines(symbol, interval, response.json())
+        return 200, response.json()
+
+    def _frankfurter(self, path: str, query: dict, raw_query: str) -> tuple:
+        rates = self.cassette.data["usd_eur"]
+        spec = path.strip("/")
+        if ".." in spec:
+            start, end = spec.split("..")
+            series = {d: {"EUR": r} for d, r in sorted(rates.items()) if start <= d <= end}
+            if series or not self.record:
+                return 200, {"amount": 1.0, "base": "USD", "start_date": start, "end_date": end, "rates": series}
+        elif spec in rates:
+            return 200, {"amount": 1.0, "base": "USD", "date": spec, "rates": {"EUR": rates[spec]}}
+        elif not self.record:
+            return 404, {"message": "not found"}
+
+        response = self._upstream("frankfurter", path, raw_query)
+        response.raise_for_status()
+        body = response.json()
+        if ".." in spec:
+            self.cassette.add_rates({d: v["EUR"] for d, v in body.get("rates", {}).items()})
+        else:
+            self.cassette.add_rates({spec: body["rates"]["EUR"]})
+        return 200, body
+
+    def _passthrough(self, path: str, raw_query: str) -> tuple:
+        if not self.record:
+            return 404, {"msg": "Sin grabar"}
+        if path.startswith("/coingecko/"):
+            response = self._upstream("coingecko", path[len("/coingecko"):], raw_query)
+        else:
+            response = self._upstream("binance", path, raw_query)
+        body = response.json()
+        if response.status_code < 500 and response.status_code != 429:
+            self.cassette.add_raw(f"{path}?{raw_query}", response.status_code, body)
+        return response.status_code, body
+
+
+def start_server(cassette_path: str, port: int = 0, record: bool = False,
+                 latency: float = 0.0, error_429: float = 0.0) -> StandInServer:
+    """Arranca el servidor en un hilo y lo devuelve (port=0: puerto libre)."""
+    server = StandInServer(Cassette(cassette_path), port, record, latency, error_429)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Suplente local de Binance/Frankfurter/CoinGecko")
+    parser.add_argument("casete")
+    parser.add_argument("--grabar", action="store_true", help="pedir a la API real lo que falte y grabarlo")
+    parser.add_argument("--puerto", type=int, default=8765)
+    parser.add_argument("--latencia", type=float, default=0.0, help="segundos por petición (±50%%)")
+    parser.add_argument("--error-429", type=float, default=0.0, help="probabilidad de responder 429")
+    args = parser.parse_args()
+
+    server = start_server(args.casete, args.puerto, args.grabar, args.latencia, args.error_429)
+    for name, value in server.env().items():
+        print(f"export {name}={value}")
+    try:
+        while True:
+            time.sleep(5)
+            server.cassette.save()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.cassette.save()
+        print(f"Peticiones: {server.counters}")
+
+
+if __name__ == "__main__":
+    main()